@@ -1,30 +1,103 @@
-from flask import Flask, request, render_template, redirect, url_for, flash, send_file, session
+from flask import Flask, request, render_template, redirect, url_for, flash, send_file, session, jsonify, g, Response, stream_with_context
 import os
+import json
+import time
+import tempfile
+import zipfile
+from flask import Request
 from werkzeug.utils import secure_filename
 import processsing
+import results_cache
+import chunked_upload
+import history_store
+import warmup
+import metrics
+import progress
 from datetime import datetime
 import pandas as pd
 
+class SpooledRequest(Request):
+    """Загружаемые файлы держим в памяти до UPLOAD_SPOOL_SIZE, дальше - во временном файле"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=app.config['UPLOAD_SPOOL_SIZE'])
+
+
 app = Flask(__name__)
+app.request_class = SpooledRequest
 app.secret_key = 'your-secret-key-here-change-me-to-random-string-12345'  # ВАЖНО: поменяйте на случайную строку
 app.config['UPLOAD_FOLDER'] = 'uploads/'
-app.config['RESULTS_FOLDER'] = '/home/vulcan4ik/dashboard-cruise-app/results'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB
+app.config['RESULTS_FOLDER'] = processsing.RESULTS_DIR
+# Лимит размера загрузки настраивается через переменную окружения MAX_UPLOAD_MB
+app.config['MAX_UPLOAD_SIZE'] = int(os.environ.get('MAX_UPLOAD_MB', 1024)) * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = app.config['MAX_UPLOAD_SIZE']
+app.config['UPLOAD_SPOOL_SIZE'] = 16 * 1024 * 1024  # 16MB в памяти на файл
+app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024  # 8MB - размер куска при загрузке по частям
+app.config['PROGRESS_POLL_INTERVAL'] = 0.5  # как часто /progress перечитывает состояние
+app.config['PROGRESS_STREAM_TIMEOUT'] = 3600  # дольше поток прогресса не держим
+app.json.sort_keys = False  # Сохраняем порядок столбцов в JSON API
 
 # Создаем папки
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['RESULTS_FOLDER'], exist_ok=True)
 
 # Разрешенные расширения
-ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'csv'}
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+DATA_EXTENSIONS = {'xlsx', 'xls', 'csv'}
+ALLOWED_EXTENSIONS = DATA_EXTENSIONS | {'zip'}
+
+def allowed_file(filename, extensions=ALLOWED_EXTENSIONS):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in extensions
+
+def open_zip_sources(archive_file):
+    """Читает из архива файлы выгрузок в буферы, возвращает пары (имя, поток)"""
+    sources = []
+    with zipfile.ZipFile(archive_file) as archive:
+        members = []
+        for member in archive.infolist():
+            name = os.path.basename(member.filename)
+            # Пропускаем папки, служебные файлы macOS и всё, что не выгрузка
+            if member.is_dir() or name.startswith('.') or '__MACOSX' in member.filename:
+                continue
+            if allowed_file(name, DATA_EXTENSIONS):
+                members.append((name, member))
+
+        # Защита от zip-бомб: распакованные данные тоже ограничены лимитом загрузки
+        if sum(member.file_size for _, member in members) > app.config['MAX_UPLOAD_SIZE']:
+            raise ValueError('Распакованный архив превышает допустимый размер загрузки')
+
+        for name, member in members:
+            buffer = tempfile.SpooledTemporaryFile(max_size=app.config['UPLOAD_SPOOL_SIZE'])
+            with archive.open(member) as source:
+                while True:
+                    chunk = source.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    buffer.write(chunk)
+            buffer.seek(0)
+            sources.append((name, buffer))
+    return sources
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # Без хука when_ready из gunicorn.conf.py (WSGI, flask run, gunicorn без конфига)
+    # прогрев запускается первым запросом; после прогрева - одна проверка словаря
+    if not warmup.WARMUP_STATE['ready']:
+        warmup.warmup_in_background()
+
+@app.after_request
+def observe_request_latency(response):
+    """Время ответа по маршруту для /metrics"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe_request(request.method, route, response.status_code, time.perf_counter() - started)
+    return response
 
 def get_currency_status():
     """Получает информацию о статусе курсов валют"""
     try:
-        rates_file = '/home/vulcan4ik/dashboard-cruise-app/app_data/currency_rates_2024-2025.csv'
+        rates_file = processsing.RATES_FILE
 
         if not os.path.exists(rates_file):
             return {
@@ -109,36 +182,160 @@ def download_file(filename):
         flash(f'Ошибка скачивания: {str(e)}')
         return redirect(url_for('index'))
 
-@app.route('/upload', methods=['GET', 'POST'])
-def upload_file():
-    """Загрузка и обработка файла"""
-    if request.method == 'GET':
-        return redirect('/')
+@app.route('/api/results/<result_id>')
+def api_results(result_id):
+    """Постраничная выдача обработанного результата в JSON"""
+    started = time.perf_counter()
 
-    if 'file' not in request.files:
-        flash('Файл не выбран')
-        return redirect(url_for('index'))
+    # Та же проверка безопасности, что и при скачивании
+    filename = result_id if result_id.endswith('.csv') else f'{result_id}.csv'
+    if '/' in filename or '\\' in filename:
+        return jsonify({'error': 'Некорректный идентификатор результата'}), 400
 
-    file = request.files['file']
+    file_path = os.path.join(app.config['RESULTS_FOLDER'], filename)
+    if not os.path.exists(file_path):
+        return jsonify({'error': 'Результат не найден'}), 404
 
-    if file.filename == '':
-        flash('Файл не выбран')
-        return redirect(url_for('index'))
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', results_cache.DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'page и per_page должны быть числами'}), 400
 
-    if not (file and allowed_file(file.filename)):
-        flash('Разрешены только файлы Excel (.xlsx, .xls) и CSV')
-        return redirect(url_for('index'))
+    columns = [c for c in request.args.get('columns', '').split(',') if c]
+
+    # Фильтр можно повторять: ?region=Москва&region=Казань
+    filters = {}
+    for column in results_cache.FILTER_COLUMNS:
+        values = request.args.getlist(column)
+        if values:
+            filters[column] = values
 
-    filepath = None
     try:
-        # Сохраняем файл
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        print(f"📂 Файл сохранён: {filepath}")
+        total, page_df = results_cache.query_result(
+            file_path,
+            page=page,
+            per_page=per_page,
+            columns=columns,
+            filters=filters,
+            sort=request.args.get('sort')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    rows = json.loads(page_df.to_json(orient='records', force_ascii=False))
+
+    return jsonify({
+        'id': filename[:-len('.csv')],
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'pages': (total + per_page - 1) // per_page,
+        'columns': list(page_df.columns),
+        'rows': rows,
+        'took_ms': round((time.perf_counter() - started) * 1000, 2)
+    })
+
+@app.route('/progress/<progress_id>')
+def progress_stream(progress_id):
+    """Прогресс обработки загрузки как Server-Sent Events; поток закрывается по завершении"""
+    if not progress.is_valid_id(progress_id):
+        return jsonify({'error': 'Некорректный идентификатор прогресса'}), 400
+
+    def events():
+        last_update = None
+        last_sent = time.monotonic()
+        started = time.monotonic()
+        while time.monotonic() - started < app.config['PROGRESS_STREAM_TIMEOUT']:
+            state = progress.read_progress(progress_id)
+            if state is not None and state['updated_at'] != last_update:
+                last_update = state['updated_at']
+                last_sent = time.monotonic()
+                yield f"data: {json.dumps(state, ensure_ascii=False)}\n\n"
+                if state['status'] != 'running':
+                    return
+            elif time.monotonic() - last_sent >= 15:
+                # Комментарий не даёт прокси закрыть соединение, пока файл ещё загружается
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            time.sleep(app.config['PROGRESS_POLL_INTERVAL'])
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики в формате Prometheus (со всех воркеров gunicorn)"""
+    currency_info = get_currency_status()
+    if 'days_old' in currency_info:
+        metrics.set_rates_age(currency_info['days_old'])
+
+    body, content_type = metrics.render()
+    return body, 200, {'Content-Type': content_type}
+
+@app.route('/api/history/vouchers/<voucher_id>')
+def api_voucher_history(voucher_id):
+    """Все версии путевки по всем загрузкам (?since=2025-01-01)"""
+    started = time.perf_counter()
+    versions = history_store.voucher_history(voucher_id, since=request.args.get('since'))
+    if not versions:
+        return jsonify({'error': 'Путевка не найдена в истории'}), 404
+
+    return jsonify({
+        'voucher_id': voucher_id,
+        'versions': versions,
+        'took_ms': round((time.perf_counter() - started) * 1000, 2)
+    })
+
+@app.route('/api/history/revenue')
+def api_revenue_history():
+    """Выручка по месяцам создания по всем загрузкам (?region=&manager=&from=2025-01&to=2025-06)"""
+    started = time.perf_counter()
+    months = history_store.revenue_by_month(
+        region=request.args.get('region'),
+        manager=request.args.get('manager'),
+        month_from=request.args.get('from'),
+        month_to=request.args.get('to')
+    )
+
+    return jsonify({
+        'months': months,
+        'took_ms': round((time.perf_counter() - started) * 1000, 2)
+    })
+
+def process_sources(sources, progress_id=None):
+    """
+    Обрабатывает выгрузки одним прогоном и перенаправляет на страницу результата
+    progress_id: идентификатор, по которому страница загрузки следит за /progress/<id>
+    """
+    # Архивы разворачиваем в список выгрузок
+    data_sources = []
+    opened = []
+    try:
+        for filename, data in sources:
+            if filename.lower().endswith('.zip'):
+                extracted = open_zip_sources(data)
+                opened.extend(buffer for _, buffer in extracted)
+                data_sources.extend(extracted)
+                print(f"🗜️ Из архива {filename} прочитано файлов: {len(extracted)}")
+            else:
+                data_sources.append((filename, data))
+
+        if not data_sources:
+            flash('В архиве нет файлов Excel или CSV')
+            return redirect(url_for('index'))
 
-        # Обрабатываем данные (ИСПРАВЛЕНО: принимаем 3 значения)
-        df_processed, result_filename, stats = processsing.process_and_upload(filepath)
+        # Обрабатываем все файлы одним прогоном
+        pipeline_started = time.perf_counter()
+        try:
+            df_processed, result_filename, stats = processsing.process_and_upload(data_sources, progress_id=progress_id)
+        except Exception:
+            metrics.observe_pipeline(time.perf_counter() - pipeline_started)
+            raise
+        metrics.observe_pipeline(time.perf_counter() - pipeline_started, stats)
 
         print(f"✅ Обработка завершена")
         print(f"📊 Обработано строк: {len(df_processed)}")
@@ -146,6 +343,8 @@ def upload_file():
         print(f"📊 Статистика: {stats}")
 
         flash('✅ Данные успешно обработаны!')
+        if len(data_sources) > 1:
+            flash(f'📂 Объединено файлов: {len(data_sources)}')
         flash(f'📊 Обработано строк: {len(df_processed)}')
         flash(f'💱 Конвертация валют выполнена')
         flash(f'📥 CSV файл готов к загрузке в DataLens')
@@ -157,6 +356,10 @@ def upload_file():
         print(f"🔗 Редирект на success с filename={result_filename}")
         return redirect(url_for('success', filename=result_filename))
 
+    except zipfile.BadZipFile:
+        flash('❌ Архив повреждён или не является zip-файлом')
+        return redirect(url_for('index'))
+
     except Exception as e:
         print(f"❌ Ошибка обработки: {str(e)}")
         import traceback
@@ -165,13 +368,111 @@ def upload_file():
         return redirect(url_for('index'))
 
     finally:
-        # Удаляем загруженный файл после обработки
-        if filepath and os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-                print(f"🗑️ Удален загруженный файл: {filename}")
-            except Exception as e:
-                print(f"⚠️ Не удалось удалить файл: {str(e)}")
+        for buffer in opened:
+            buffer.close()
+
+@app.route('/upload', methods=['GET', 'POST'])
+def upload_file():
+    """Загрузка и обработка файлов (несколько файлов или zip-архив)"""
+    if request.method == 'GET':
+        return redirect('/')
+
+    files = [f for f in request.files.getlist('file') if f and f.filename]
+
+    if not files:
+        flash('Файл не выбран')
+        return redirect(url_for('index'))
+
+    if not all(allowed_file(f.filename) for f in files):
+        flash('Разрешены только файлы Excel (.xlsx, .xls), CSV и zip-архивы с ними')
+        return redirect(url_for('index'))
+
+    # Разбираем прямо из буфера загрузки, без сохранения в UPLOAD_FOLDER
+    for file in files:
+        print(f"📂 Получен файл: {file.filename}")
+    return process_sources([(secure_filename(f.filename), f.stream) for f in files],
+                           progress_id=request.form.get('progress_id'))
+
+@app.route('/upload/chunks', methods=['POST'])
+def chunked_upload_start():
+    """Начало загрузки большого файла по частям"""
+    payload = request.get_json(silent=True) or {}
+    filename = secure_filename(str(payload.get('filename', '')))
+
+    try:
+        size = int(payload.get('size', 0))
+    except (TypeError, ValueError):
+        size = 0
+
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Разрешены только файлы Excel (.xlsx, .xls), CSV и zip-архивы с ними'}), 400
+    if size <= 0:
+        return jsonify({'error': 'Не указан размер файла'}), 400
+    if size > app.config['MAX_UPLOAD_SIZE']:
+        return jsonify({'error': f"Файл больше {app.config['MAX_UPLOAD_SIZE'] // (1024 * 1024)} МБ"}), 413
+
+    upload_id = chunked_upload.start_upload(app.config['UPLOAD_FOLDER'], filename, size)
+    print(f"📥 Начата загрузка по частям: {filename} ({size} байт), id={upload_id}")
+
+    return jsonify({
+        'upload_id': upload_id,
+        'chunk_size': app.config['UPLOAD_CHUNK_SIZE'],
+        'received': 0
+    })
+
+@app.route('/upload/chunks/<upload_id>', methods=['GET', 'PUT'])
+def chunked_upload_chunk(upload_id):
+    """GET - сколько уже получено (для докачки), PUT - очередной кусок"""
+    try:
+        if request.method == 'GET':
+            upload = chunked_upload.get_upload(app.config['UPLOAD_FOLDER'], upload_id)
+            if upload is None:
+                return jsonify({'error': 'Загрузка не найдена'}), 404
+            return jsonify({'received': upload['received'], 'size': upload['size']})
+
+        offset = int(request.args.get('offset', -1))
+        accepted, received = chunked_upload.append_chunk(
+            app.config['UPLOAD_FOLDER'], upload_id, offset, request.stream
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # 409: клиент прислал кусок не с того места - пусть продолжит с received
+    return jsonify({'received': received}), (200 if accepted else 409)
+
+@app.route('/upload/chunks/complete', methods=['POST'])
+def chunked_upload_complete():
+    """Обработка полностью загруженных по частям файлов"""
+    upload_ids = request.form.getlist('upload_id')
+
+    uploads = []
+    for upload_id in upload_ids:
+        try:
+            upload = chunked_upload.get_upload(app.config['UPLOAD_FOLDER'], upload_id)
+        except ValueError:
+            upload = None
+        if upload is None or not upload['complete']:
+            flash('Файл загружен не полностью, повторите загрузку')
+            return redirect(url_for('index'))
+        uploads.append((upload_id, upload))
+
+    if not uploads:
+        flash('Файл не выбран')
+        return redirect(url_for('index'))
+
+    try:
+        # Собранные файлы уже на диске - передаём пути, их можно читать в процессах
+        return process_sources([(upload['filename'], upload['path']) for _, upload in uploads],
+                               progress_id=request.form.get('progress_id'))
+    finally:
+        for upload_id, _ in uploads:
+            chunked_upload.finish_upload(app.config['UPLOAD_FOLDER'], upload_id)
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    """Загрузка превышает MAX_CONTENT_LENGTH"""
+    flash(f"❌ Файл больше {app.config['MAX_UPLOAD_SIZE'] // (1024 * 1024)} МБ")
+    return redirect(url_for('index'))
 
 @app.route('/success')
 def success():
@@ -189,6 +490,14 @@ def success():
 
     return render_template('success.html', filename=filename, stats=stats)
 
+@app.route('/ready')
+def ready():
+    """Готовность к приёму загрузок: 503, пока не завершился прогрев"""
+    state = warmup.WARMUP_STATE
+    return jsonify(state), 200 if state['ready'] else 503
+
 if __name__ == '__main__':
+    # Без gunicorn прогреваемся в фоне, сервер стартует сразу
+    warmup.warmup_in_background()
     app.run(debug=True)
 
@@ -0,0 +1,109 @@
+# chunked_upload.py
+import fcntl
+import json
+import os
+import re
+import time
+import uuid
+
+
+# Незавершённые загрузки старше суток удаляются
+STALE_UPLOAD_SEC = 24 * 60 * 60
+
+# Размер куска при копировании из запроса в файл
+COPY_BUFFER_SIZE = 1024 * 1024
+
+_UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _paths(upload_dir, upload_id):
+    """Пути к данным и метаданным загрузки"""
+    if not _UPLOAD_ID_RE.match(upload_id or ''):
+        raise ValueError('Некорректный идентификатор загрузки')
+    base = os.path.join(upload_dir, f'{upload_id}.chunked')
+    return base + '.part', base + '.json'
+
+
+def cleanup_stale(upload_dir, max_age=STALE_UPLOAD_SEC):
+    """Удаляет брошенные незавершённые загрузки"""
+    now = time.time()
+    for name in os.listdir(upload_dir):
+        if not (name.endswith('.chunked.part') or name.endswith('.chunked.json')):
+            continue
+        path = os.path.join(upload_dir, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def start_upload(upload_dir, filename, size):
+    """Регистрирует новую загрузку по частям, возвращает её идентификатор"""
+    cleanup_stale(upload_dir)
+
+    upload_id = uuid.uuid4().hex
+    part_path, meta_path = _paths(upload_dir, upload_id)
+
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'filename': filename, 'size': size}, f, ensure_ascii=False)
+
+    return upload_id
+
+
+def get_upload(upload_dir, upload_id):
+    """Состояние загрузки: имя файла, ожидаемый размер и сколько уже получено"""
+    part_path, meta_path = _paths(upload_dir, upload_id)
+    if not os.path.exists(meta_path) or not os.path.exists(part_path):
+        return None
+
+    with open(meta_path, encoding='utf-8') as f:
+        meta = json.load(f)
+
+    meta['received'] = os.path.getsize(part_path)
+    meta['path'] = part_path
+    meta['complete'] = meta['received'] == meta['size']
+    return meta
+
+
+def append_chunk(upload_dir, upload_id, offset, stream):
+    """
+    Дописывает кусок из потока запроса, если offset совпадает с уже полученным
+    Возвращает: (принят ли кусок, сколько байт получено всего)
+    """
+    upload = get_upload(upload_dir, upload_id)
+    if upload is None:
+        raise ValueError('Загрузка не найдена')
+
+    with open(upload['path'], 'ab') as f:
+        # Повтор куска, пока первый ещё пишется, или два запроса в разных потоках/воркерах:
+        # смещение сверяем с размером файла под блокировкой, иначе оба куска допишутся
+        fcntl.flock(f, fcntl.LOCK_EX)
+        received = os.fstat(f.fileno()).st_size
+
+        # Повтор или пропуск куска: клиент должен продолжить с нашего смещения
+        if offset != received:
+            return False, received
+
+        written = received
+        while True:
+            data = stream.read(COPY_BUFFER_SIZE)
+            if not data:
+                break
+            written += len(data)
+            if written > upload['size']:
+                f.truncate(received)
+                raise ValueError('Получено больше данных, чем заявлено')
+            f.write(data)
+        # Блокировка снимается при закрытии файла - после записи буфера
+        f.flush()
+
+    return True, written
+
+
+def finish_upload(upload_dir, upload_id):
+    """Удаляет файлы загрузки после обработки"""
+    for path in _paths(upload_dir, upload_id):
+        if os.path.exists(path):
+            os.remove(path)
@@ -8,7 +8,7 @@ from xml.etree import ElementTree as ET
 import os
 
 # Пути к данным и логам
-RATES_FILE = '/home/vulcan4ik/dashboard-cruise-app/app_data/currency_rates_2024-2025.csv'
+RATES_FILE = os.environ.get('CURRENCY_RATES_FILE', '/home/vulcan4ik/dashboard-cruise-app/app_data/currency_rates_2024-2025.csv')
 LOG_FILE = '/home/vulcan4ik/dashboard-cruise-app/app_data/currency_updater.log'
 
 
@@ -111,6 +111,22 @@ def download_cbr_rates_full(start_date='2024-01-01', end_date=None):
         return None
 
 
+def refresh_processed_results(rates_file=RATES_FILE):
+    """Пересчитывает рубли в уже обработанных результатах по новым курсам и пишет отчёт в лог"""
+    started = time.perf_counter()
+    try:
+        import processsing
+        refreshed = processsing.refresh_results(rates_file)
+    except Exception as e:
+        log_message(f"⚠️ Пересчёт сохранённых результатов не выполнен: {e}")
+        return []
+
+    for item in refreshed:
+        log_message(f"🔁 {item['result']}: пересчитано строк {item['rows']} за {item['seconds']} сек")
+    log_message(f"🔁 Пересчитано результатов: {len(refreshed)} за {time.perf_counter() - started:.2f} сек")
+    return refreshed
+
+
 def update_exchange_rates(rates_file=RATES_FILE):
     """Дозагружает курсы за недостающий период и сохраняет"""
 
@@ -127,7 +143,8 @@ def update_exchange_rates(rates_file=RATES_FILE):
             return {
                 'status': 'success',
                 'message': f'Курсы загружены до {df["date"].max().strftime("%d.%m.%Y")}',
-                'data': df
+                'data': df,
+                'refreshed': refresh_processed_results(rates_file)
             }
         return {'status': 'error', 'message': 'Не удалось загрузить курсы', 'data': None}
 
@@ -187,11 +204,15 @@ def update_exchange_rates(rates_file=RATES_FILE):
             log_message(f"📊 Всего записей: {len(updated_df)}")
             log_message(f"📅 Период: {updated_df['date'].min().strftime('%d.%m.%Y')} - {latest_date.strftime('%d.%m.%Y')}")
             log_message(f"\n✅ ОБНОВЛЕНИЕ ЗАВЕРШЕНО УСПЕШНО\n")
-            
+
+            # Результаты, обработанные со старыми курсами, пересчитываются сразу
+            refreshed = refresh_processed_results(rates_file)
+
             return {
                 'status': 'success',
                 'message': f'Курсы валют обновлены до {latest_date.strftime("%d.%m.%Y")}',
-                'data': updated_df
+                'data': updated_df,
+                'refreshed': refreshed
             }
         else:
             log_message("\n⚠️ Не удалось загрузить новые данные")
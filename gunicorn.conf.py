@@ -0,0 +1,48 @@
+# gunicorn.conf.py
+# Запуск: gunicorn -c gunicorn.conf.py app:app
+import os
+import tempfile
+
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+
+# Обработка файла - долгий запрос; потоки позволяют воркеру отвечать на /ready и API параллельно
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 600))
+
+# Приложение загружается в мастере, чтобы прогрев был общим для всех воркеров
+preload_app = True
+
+# Метрики Prometheus: воркеры пишут значения в общую папку, /metrics собирает их со всех.
+# Переменная должна быть задана до загрузки приложения; файлы прошлого запуска удаляются
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'cruise-dashboard-metrics')
+)
+os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+for name in os.listdir(PROMETHEUS_MULTIPROC_DIR):
+    if name.endswith('.db'):
+        os.remove(os.path.join(PROMETHEUS_MULTIPROC_DIR, name))
+
+# WARMUP=0 отключает прогрев (например, чтобы замерить первую загрузку без него)
+WARMUP_ENABLED = os.environ.get('WARMUP', '1') != '0'
+
+
+def when_ready(server):
+    """Вызывается в мастере после загрузки приложения и до запуска воркеров"""
+    import warmup
+
+    if not WARMUP_ENABLED:
+        warmup.skip_warmup()
+        server.log.info('Прогрев отключён (WARMUP=0)')
+        return
+
+    state = warmup.warmup()
+    server.log.info('Прогрев завершён за %s сек', state['seconds'])
+
+
+def child_exit(server, worker):
+    """Воркер остановлен: его значения gauge больше не показываются в /metrics"""
+    import metrics
+    metrics.mark_process_dead(worker.pid)
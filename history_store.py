@@ -0,0 +1,437 @@
+# history_store.py
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+
+# База истории обработанных путевок (актуальная строка на путевку + её прежние версии)
+HISTORY_DB = os.environ.get('HISTORY_DB', '/home/vulcan4ik/dashboard-cruise-app/app_data/history.sqlite3')
+
+# Столбцы результата, которые храним (days_until_checkin зависит от даты обработки - не храним)
+HISTORY_COLUMNS = {
+    'country': 'TEXT',
+    'creation_date': 'TEXT',
+    'checkin_date': 'TEXT',
+    'days': 'REAL',
+    'people': 'INTEGER',
+    'voucher_status': 'TEXT',
+    'internal_status': 'TEXT',
+    'currency': 'TEXT',
+    'amount_to_pay': 'REAL',
+    'payment': 'REAL',
+    'tour_name': 'TEXT',
+    'buyer_department': 'TEXT',
+    'buyer_name': 'TEXT',
+    'buyer_category': 'TEXT',
+    'creator': 'TEXT',
+    'manager': 'TEXT',
+    'amount_rub': 'REAL',
+    'region': 'TEXT',
+    'is_cruise_seller': 'INTEGER',
+    'payment_percentage': 'REAL',
+    'creation_month': 'TEXT',
+}
+
+# Строк в одном executemany при загрузке
+INSERT_BATCH_SIZE = 50000
+
+# Индексы для исторических запросов
+INDEXED_COLUMNS = ['creation_month', 'region', 'manager', 'checkin_date']
+
+# Если в таблице меньше строк, чем эта доля загрузки (почти все путевки новые),
+# индексы выгоднее построить заново, чем обновлять на каждой вставке
+REBUILD_INDEXES_RATIO = 0.5
+
+# Загрузки от этого числа строк пишутся в историю в фоне, не задерживая ответ /upload
+# (миллион путевок: ~20 сек первая загрузка, ~6 сек повторная без изменений)
+BACKGROUND_MIN_ROWS = int(os.environ.get('HISTORY_BACKGROUND_MIN_ROWS', 100000))
+
+# Если базу дольше таймаута sqlite (30 сек) держит другой процесс, запись повторяется,
+# а не теряется
+LOCKED_RETRIES = int(os.environ.get('HISTORY_LOCKED_RETRIES', 10))
+LOCKED_RETRY_DELAY_SEC = 1
+
+# Все записи в историю процесса идут через один поток по очереди, в порядке загрузок:
+# иначе маленькая загрузка из запроса могла бы записаться раньше большой из очереди,
+# и более старая версия путевки стала бы актуальной
+_WRITER = None
+_WRITER_LOCK = threading.Lock()
+_PENDING_WRITES = 0
+
+
+def _columns_sql(prefix=''):
+    return ', '.join(f'{prefix}{column}' for column in HISTORY_COLUMNS)
+
+
+def _create_indexes(conn):
+    for column in INDEXED_COLUMNS:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_vouchers_{column} ON vouchers({column})')
+
+
+def _drop_indexes(conn):
+    for column in INDEXED_COLUMNS:
+        conn.execute(f'DROP INDEX IF EXISTS idx_vouchers_{column}')
+
+
+def connect(db_path=None):
+    """Открывает базу истории и создаёт схему при первом обращении"""
+    db_path = db_path or HISTORY_DB
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    # WAL: чтение истории не блокируется загрузкой новых данных
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-262144')  # 256MB кэша страниц для массовой загрузки
+    conn.execute('PRAGMA temp_store=MEMORY')
+
+    column_defs = ',\n'.join(f'    {column} {sql_type}' for column, sql_type in HISTORY_COLUMNS.items())
+    conn.executescript(f'''
+CREATE TABLE IF NOT EXISTS loads (
+    load_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source_file TEXT,
+    loaded_at TEXT NOT NULL,
+    rows INTEGER,
+    inserted INTEGER,
+    updated INTEGER
+);
+
+-- Актуальная версия каждой путевки
+CREATE TABLE IF NOT EXISTS vouchers (
+    voucher_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    load_id INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+    row_hash INTEGER NOT NULL,
+{column_defs}
+);
+
+-- Предыдущие версии: сюда строка попадает только когда путевка изменилась
+CREATE TABLE IF NOT EXISTS voucher_versions (
+    voucher_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    load_id INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+{column_defs},
+    PRIMARY KEY (voucher_id, version)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS archive_voucher_version
+BEFORE UPDATE ON vouchers
+BEGIN
+    INSERT INTO voucher_versions (voucher_id, version, load_id, updated_at, {_columns_sql()})
+    VALUES (OLD.voucher_id, OLD.version, OLD.load_id, OLD.updated_at, {_columns_sql('OLD.')});
+END;
+''')
+    _create_indexes(conn)
+    return conn
+
+
+def _column_values(series):
+    """Значения столбца в типах, понятных sqlite3 (пропуски - None)"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        # Всегда '%Y-%m-%d %H:%M:%S', как в CSV результата: строки дат сравниваются в запросах
+        # (индекс по checkin_date), поэтому формат не должен зависеть от загрузки.
+        # Без поэлементного strftime: ISO 8601 с заменой 'T' на пробел
+        values = series.to_numpy(dtype='datetime64[s]')
+        strings = np.datetime_as_string(values, unit='s')
+        chars = strings.view('U1').reshape(-1, strings.dtype.itemsize // 4)
+        chars[:, 10] = ' '
+        strings = strings.astype(object)
+        strings[np.isnat(values)] = None
+        return strings.tolist()
+
+    if pd.api.types.is_bool_dtype(series):
+        return series.astype(int).tolist()
+
+    values = series.astype(object)
+    return values.where(series.notna(), None).tolist()
+
+
+def _row_hashes(df):
+    """Хэш содержимого строки по хранимым столбцам - по нему находим изменённые путевки"""
+    present = {}
+    for column in HISTORY_COLUMNS:
+        if column not in df.columns:
+            continue
+        series = df[column]
+        # int64 и float64 в разных выгрузках не должны давать новую версию
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            series = series.astype('float64')
+        present[column] = series
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(present), index=False)
+    # В SQLite INTEGER знаковый
+    return hashes.to_numpy().view(np.int64)
+
+
+def _load_rows(df, load_id, loaded_at, voucher_ids, hashes):
+    """Кортежи параметров для вставки (столбцы, которых нет в результате, пишем как NULL)"""
+    columns = []
+    for column in HISTORY_COLUMNS:
+        if column in df.columns:
+            columns.append(_column_values(df[column]))
+        else:
+            columns.append(repeat(None))
+    return list(zip(voucher_ids.tolist(), repeat(load_id), repeat(loaded_at),
+                    hashes.tolist(), *columns))
+
+
+def upsert_results(df, source_file=None, db_path=None):
+    """
+    Добавляет обработанные строки в историю: новая путевка получает версию 1,
+    изменённая - следующую версию, неизменённая не трогается
+    voucher_id должен быть уже приведён к строке (processsing.normalize_voucher_ids)
+    Возвращает: статистику загрузки
+    """
+    started = time.perf_counter()
+    loaded_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    voucher_ids = df['voucher_id'].to_numpy(dtype=object)
+    hashes = _row_hashes(df)
+
+    placeholders = ', '.join(['?'] * (len(HISTORY_COLUMNS) + 3))
+    updates = ', '.join(f'{c} = excluded.{c}' for c in HISTORY_COLUMNS)
+    # Новые путевки - обычная вставка, без проверки конфликта на каждой строке
+    insert_sql = f'''
+        INSERT INTO vouchers (voucher_id, version, load_id, updated_at, row_hash, {_columns_sql()})
+        VALUES (?, 1, {placeholders})
+    '''
+    # Прежняя версия изменённой путевки уходит в voucher_versions триггером
+    upsert_sql = f'''
+        INSERT INTO vouchers (voucher_id, version, load_id, updated_at, row_hash, {_columns_sql()})
+        VALUES (?, 1, {placeholders})
+        ON CONFLICT (voucher_id) DO UPDATE SET
+            {updates},
+            version = vouchers.version + 1,
+            load_id = excluded.load_id,
+            updated_at = excluded.updated_at,
+            row_hash = excluded.row_hash
+        WHERE vouchers.row_hash IS NOT excluded.row_hash
+    '''
+
+    conn = connect(db_path)
+    try:
+        with conn:
+            load_id = conn.execute(
+                'INSERT INTO loads (source_file, loaded_at, rows) VALUES (?, ?, ?)',
+                (source_file, loaded_at, len(df))
+            ).lastrowid
+
+            # Сравниваем хэши в pandas и пишем в базу только новые и изменённые путевки
+            # Кортежи вместо sqlite3.Row: на миллионе путевок это вдвое быстрее
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            stored = pd.DataFrame(
+                cursor.execute('SELECT voucher_id, row_hash FROM vouchers').fetchall(),
+                columns=['voucher_id', 'row_hash']
+            )
+            stored_hashes = pd.Series(stored['row_hash'].to_numpy(), index=stored['voucher_id'])
+            previous = stored_hashes.reindex(voucher_ids).to_numpy()
+            is_new = pd.isna(previous)
+            is_changed = ~is_new & (previous != hashes)
+            write = is_new | is_changed
+            inserted = int(is_new.sum())
+            updated = int(is_changed.sum())
+
+            # Если почти все путевки новые, индексы выгоднее построить заново
+            rebuild_indexes = len(stored) < inserted * REBUILD_INDEXES_RATIO
+            if rebuild_indexes:
+                _drop_indexes(conn)
+
+            # Повтор путевки внутри загрузки - через upsert, как и изменённые
+            is_new &= ~pd.Series(voucher_ids).duplicated().to_numpy()
+            for sql, mask in ((insert_sql, is_new), (upsert_sql, write & ~is_new)):
+                part_df, part_ids, part_hashes = df[mask], voucher_ids[mask], hashes[mask]
+                for batch_start in range(0, len(part_df), INSERT_BATCH_SIZE):
+                    batch = slice(batch_start, batch_start + INSERT_BATCH_SIZE)
+                    conn.executemany(sql, _load_rows(
+                        part_df.iloc[batch], load_id, loaded_at,
+                        part_ids[batch], part_hashes[batch]
+                    ))
+
+            if rebuild_indexes:
+                _create_indexes(conn)
+
+            conn.execute('UPDATE loads SET inserted = ?, updated = ? WHERE load_id = ?',
+                         (inserted, updated, load_id))
+    finally:
+        conn.close()
+
+    unchanged = len(df) - inserted - updated
+    elapsed = round(time.perf_counter() - started, 3)
+    print(f"🗄️ История обновлена: новых путевок {inserted}, изменённых {updated}, "
+          f"без изменений {unchanged} ({elapsed} сек)")
+
+    return {
+        'load_id': load_id,
+        'inserted': inserted,
+        'updated': updated,
+        'unchanged': unchanged,
+        'seconds': elapsed
+    }
+
+
+def refresh_amounts(df, source_file, db_path=None):
+    """
+    Пересчитанные по новым курсам суммы результата source_file: обновляются только путевки,
+    актуальная версия которых пришла из этого результата (более поздние загрузки не трогаются)
+    Возвращает: статистику обновления; loaded=False - загрузка source_file ещё не записана
+    в историю (например, ждёт в очереди другого процесса), обновлять было нечего
+    """
+    started = time.perf_counter()
+    updated_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    voucher_ids = df['voucher_id'].tolist()
+    amounts = _column_values(df['amount_rub'])
+    percentages = _column_values(df['payment_percentage'])
+    hashes = _row_hashes(df).tolist()
+
+    # Изменение суммы - новая версия: прежняя уходит в voucher_versions триггером
+    update_sql = '''
+        UPDATE vouchers SET
+            amount_rub = ?, payment_percentage = ?, row_hash = ?,
+            version = version + 1, updated_at = ?
+        WHERE voucher_id = ?
+          AND load_id IN (SELECT load_id FROM loads WHERE source_file = ?)
+          AND (amount_rub IS NOT ? OR payment_percentage IS NOT ?)
+    '''
+    params = [
+        (amount, percentage, row_hash, updated_at, voucher_id, source_file, amount, percentage)
+        for voucher_id, amount, percentage, row_hash in zip(voucher_ids, amounts, percentages, hashes)
+    ]
+
+    conn = connect(db_path)
+    try:
+        with conn:
+            loaded = conn.execute(
+                'SELECT 1 FROM loads WHERE source_file = ? LIMIT 1', (source_file,)
+            ).fetchone() is not None
+            # rowcount не учитывает строки, вставленные триггером
+            updated = conn.executemany(update_sql, params).rowcount if loaded else 0
+    finally:
+        conn.close()
+
+    elapsed = round(time.perf_counter() - started, 3)
+    print(f"🗄️ История: пересчитано сумм путевок {updated} из {len(df)} ({source_file}, {elapsed} сек)")
+    return {'updated': updated, 'loaded': loaded, 'seconds': elapsed}
+
+
+def _write_with_retry(write, df, source_file, db_path):
+    """Запись в потоке очереди: повтор, пока база занята другим процессом"""
+    for attempt in range(LOCKED_RETRIES + 1):
+        try:
+            return write(df, source_file, db_path)
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or attempt == LOCKED_RETRIES:
+                print(f"⚠️ Не удалось обновить историю путевок ({source_file}): {e}")
+                raise
+            print(f"⏳ База истории занята, повтор {attempt + 1}/{LOCKED_RETRIES} ({source_file})")
+            time.sleep(LOCKED_RETRY_DELAY_SEC)
+        except Exception as e:
+            print(f"⚠️ Не удалось обновить историю путевок ({source_file}): {e}")
+            raise
+
+
+def _write_done(future):
+    global _PENDING_WRITES
+    with _WRITER_LOCK:
+        _PENDING_WRITES -= 1
+
+
+def _submit(write, df, source_file, db_path):
+    global _WRITER, _PENDING_WRITES
+    with _WRITER_LOCK:
+        # Создаётся в воркере при первой загрузке, а не в мастере gunicorn до fork
+        if _WRITER is None:
+            _WRITER = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-writer')
+        _PENDING_WRITES += 1
+    future = _WRITER.submit(_write_with_retry, write, df, source_file, db_path)
+    future.add_done_callback(_write_done)
+    return future
+
+
+def pending_writes():
+    """Сколько записей в историю ещё в очереди этого процесса (включая текущую)"""
+    with _WRITER_LOCK:
+        return _PENDING_WRITES
+
+
+def submit_results(df, source_file=None, db_path=None):
+    """
+    Ставит загрузку в очередь записи в историю (upsert_results)
+    Возвращает: Future со статистикой загрузки; ждать его или нет - решает вызывающий
+    """
+    return _submit(upsert_results, df, source_file, db_path)
+
+
+def submit_refreshed_amounts(df, source_file, db_path=None):
+    """
+    Ставит пересчёт сумм (refresh_amounts) в ту же очередь: он выполнится
+    после всех загрузок, поставленных раньше
+    Возвращает: Future со статистикой обновления
+    """
+    return _submit(refresh_amounts, df, source_file, db_path)
+
+
+def voucher_history(voucher_id, since=None, db_path=None):
+    """Все версии путевки (с даты since, если задана) в порядке загрузки"""
+    since_condition = 'AND updated_at >= ?' if since else ''
+    query = f'''
+        SELECT voucher_id, version, updated_at, {_columns_sql()}
+        FROM voucher_versions WHERE voucher_id = ? {since_condition}
+        UNION ALL
+        SELECT voucher_id, version, updated_at, {_columns_sql()}
+        FROM vouchers WHERE voucher_id = ? {since_condition}
+        ORDER BY version
+    '''
+    params = [voucher_id, since, voucher_id, since] if since else [voucher_id, voucher_id]
+
+    conn = connect(db_path)
+    try:
+        return [dict(row) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+
+
+def revenue_by_month(region=None, manager=None, month_from=None, month_to=None, db_path=None):
+    """Выручка по месяцам создания по всем загрузкам (актуальные версии путевок)"""
+    conditions = []
+    params = []
+    if region:
+        conditions.append('region = ?')
+        params.append(region)
+    if manager:
+        conditions.append('manager = ?')
+        params.append(manager)
+    if month_from:
+        conditions.append('creation_month >= ?')
+        params.append(month_from)
+    if month_to:
+        conditions.append('creation_month <= ?')
+        params.append(month_to)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    query = f'''
+        SELECT creation_month,
+               COUNT(*) AS vouchers,
+               ROUND(SUM(amount_rub), 2) AS amount_rub,
+               ROUND(SUM(payment), 2) AS payment
+        FROM vouchers
+        {where}
+        GROUP BY creation_month
+        ORDER BY creation_month
+    '''
+
+    conn = connect(db_path)
+    try:
+        return [dict(row) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
@@ -0,0 +1,106 @@
+# metrics.py
+"""
+Метрики Prometheus для /metrics
+
+Под gunicorn каждый воркер пишет значения в общую папку PROMETHEUS_MULTIPROC_DIR
+(её готовит gunicorn.conf.py), и /metrics в любом воркере собирает их со всех.
+Без этой переменной (python app.py) используется обычный реестр процесса.
+
+Запись значения - несколько микросекунд: время маршрута замеряется на каждый запрос,
+а этапы обработки снимаются один раз из PROCESSING_STATS после загрузки.
+"""
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+# Ответы от миллисекунд (API) до минут (обработка большого файла)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Этапы обработки: этап -> ключ времени в PROCESSING_STATS
+PIPELINE_STAGES = {
+    'preflight': 'preflight_time_sec',
+    'parse': 'parse_time_sec',
+    'dedup': 'dedup_time_sec',
+    'enrich': 'enrich_time_sec',
+    'save': 'save_time_sec',
+    'history': 'history_time_sec'
+}
+
+REQUEST_LATENCY = Histogram(
+    'cruise_http_request_duration_seconds', 'Время ответа по маршрутам',
+    ['method', 'route', 'status'], buckets=REQUEST_BUCKETS
+)
+PIPELINE_DURATION = Histogram(
+    'cruise_pipeline_duration_seconds', 'Время обработки загрузки целиком',
+    ['outcome'], buckets=STAGE_BUCKETS
+)
+STAGE_DURATION = Histogram(
+    'cruise_pipeline_stage_duration_seconds', 'Время этапа обработки',
+    ['stage'], buckets=STAGE_BUCKETS
+)
+PIPELINE_ROWS = Counter('cruise_pipeline_rows', 'Строки до и после обработки', ['kind'])
+CURRENCY_CONVERSIONS = Counter('cruise_currency_conversions', 'Суммы, сконвертированные в рубли')
+SHEETS_LATENCY = Histogram(
+    'cruise_sheets_upload_duration_seconds', 'Время загрузки в Google Sheets',
+    ['outcome'], buckets=STAGE_BUCKETS
+)
+SHEETS_UPLOADS = Counter('cruise_sheets_uploads', 'Загрузки в Google Sheets по результату', ['outcome'])
+# Ставится при каждом запросе /metrics; из воркеров берётся последнее значение
+RATES_AGE = Gauge(
+    'cruise_currency_rates_age_days', 'Сколько дней прошло с последней даты курсов',
+    multiprocess_mode='mostrecent'
+)
+
+
+def observe_request(method, route, status, seconds):
+    """Время ответа; route - шаблон маршрута Flask, чтобы id не раздували число рядов"""
+    REQUEST_LATENCY.labels(method, route, str(status)).observe(seconds)
+
+
+def observe_pipeline(seconds, stats=None):
+    """Итог обработки загрузки; stats=None - обработка завершилась ошибкой"""
+    if stats is None:
+        PIPELINE_DURATION.labels('error').observe(seconds)
+        return
+
+    PIPELINE_DURATION.labels('success').observe(seconds)
+    for stage, key in PIPELINE_STAGES.items():
+        # Запись большой загрузки в историю идёт в фоне - в ответ её время не входит
+        if stage == 'history' and stats.get('history_status') == 'background':
+            continue
+        STAGE_DURATION.labels(stage).observe(stats.get(key, 0.0))
+
+    PIPELINE_ROWS.labels('input').inc(stats.get('original_rows', 0))
+    PIPELINE_ROWS.labels('output').inc(stats.get('final_rows', 0))
+    CURRENCY_CONVERSIONS.inc(stats.get('converted_currency', 0))
+
+    # Пропущенная загрузка (нет credentials) - не запрос к Sheets, её время не пишем
+    sheets_status = stats.get('sheets_status', 'skipped')
+    SHEETS_UPLOADS.labels(sheets_status).inc()
+    if sheets_status != 'skipped':
+        SHEETS_LATENCY.labels(sheets_status).observe(stats.get('sheets_time_sec', 0.0))
+
+
+def set_rates_age(days_old):
+    RATES_AGE.set(days_old)
+
+
+def render():
+    """Текст метрик для /metrics: (тело, Content-Type)"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Вызывается из gunicorn при остановке воркера: его живые gauge больше не учитываются"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
@@ -1,18 +1,114 @@
 # processsing.py
 import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials
 import os
 from datetime import datetime
 import re
+import time
+import importlib
+import io
+import json
+import multiprocessing
+import shutil
+import tempfile
+import threading
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import history_store
+import progress
 
+# Copy-on-write: выборка столбцов и переименование не копируют данные,
+# а новый столбец копируется только при записи в него (в pandas >= 3 включено всегда)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+
+# Пути к данным (переопределяются через окружение, например для нагрузочного теста)
+RATES_FILE = os.environ.get('CURRENCY_RATES_FILE', '/home/vulcan4ik/dashboard-cruise-app/app_data/currency_rates_2024-2025.csv')
+RESULTS_DIR = os.environ.get('RESULTS_DIR', '/home/vulcan4ik/dashboard-cruise-app/results')
+CREDENTIALS_FILE = os.environ.get('GOOGLE_CREDENTIALS_FILE', '/home/vulcan4ik/dashboard-cruise-app/credentials.json')
+
+# Подмена клиента Google Sheets: "модуль:функция", функция возвращает клиент с API gspread
+SHEETS_CLIENT_FACTORY = os.environ.get('CRUISE_SHEETS_CLIENT')
 
 # Глобальная переменная для кэширования курсов
 _CURRENCY_RATES_CACHE = None
+_CURRENCY_RATES_MTIME = None
 
 # Глобальная переменная для статистики обработки
 PROCESSING_STATS = {}
+_PIPELINE_LOCK = threading.Lock()
+
+# Прогресс текущей обработки (см. process_and_upload); по умолчанию ничего не пишет
+_PROGRESS = progress.ProgressReporter()
+
+# Столбцы выгрузки, которые нужны пайплайну: исходное имя -> итоговое
+COLUMN_RENAMES = {
+    'Путевка': 'voucher_id',
+    'Страна': 'country',
+    'Дата создания': 'creation_date',
+    'Дата заезда': 'checkin_date',
+    'Дней': 'days',
+    'Человек': 'people',
+    'Статус путевки': 'voucher_status',
+    'Внутренний статус': 'internal_status',
+    'Валюта': 'currency',
+    'Сумма к оплате': 'amount_to_pay',
+    'Оплата': 'payment',
+    'Название тура': 'tour_name',
+    'Покупатель: Ответственное подразделение': 'buyer_department',
+    'Покупатель: Наименование': 'buyer_name',
+    'Покупатель: Категория ТА': 'buyer_category',
+    'Создатель': 'creator',
+    'Ведущий менеджер': 'manager'
+}
+COLUMN_RENAME_TARGETS = set(COLUMN_RENAMES.values())
+
+# Без этих столбцов выгрузка не может быть обработана (проверяются до чтения файла)
+REQUIRED_COLUMNS = ['Путевка', 'Статус путевки', 'Дата создания', 'Валюта', 'Сумма к оплате']
+
+# CSV больше этого числа строк (по оценке из заголовка) читается кусками
+STREAMING_ROWS_THRESHOLD = int(os.environ.get('STREAMING_ROWS_THRESHOLD', 500000))
+CSV_CHUNK_ROWS = 200000
+
+# Сколько байт начала CSV читаем для оценки числа строк
+ROW_ESTIMATE_SAMPLE_BYTES = 64 * 1024
+
+# Excel из потока загрузки передаётся в процесс разбора байтами, а крупнее - через временный файл
+EXCEL_BYTES_MAX = 32 * 1024 * 1024
+
+# Режим экономии памяти: ненужные пайплайну столбцы выгрузки не читаются вовсе
+LOW_MEMORY_PIPELINE = os.environ.get('LOW_MEMORY_PIPELINE', '1') != '0'
+
+# Столбцы, которые добавляет enrich_data (всё остальное - данные до обогащения)
+ENRICHED_COLUMNS = ['amount_rub', 'region', 'is_cruise_seller', 'payment_percentage', 'days_until_checkin', 'creation_month']
+
+# Обогащение по частям в нескольких процессах (PARALLEL_ENRICHMENT=0 - всегда одно ядро)
+PARALLEL_ENRICHMENT = os.environ.get('PARALLEL_ENRICHMENT', '1') != '0'
+ENRICH_WORKERS = int(os.environ.get('ENRICH_WORKERS', os.cpu_count() or 1))
+# Ниже этого числа строк запуск процессов дороже выигрыша
+ENRICH_PARALLEL_MIN_ROWS = int(os.environ.get('ENRICH_PARALLEL_MIN_ROWS', 50000))
+ENRICH_MIN_PARTITION_ROWS = 10000
+
+# Процессы пулов не форкаются от воркера: в gthread-воркере fork копирует блокировки,
+# захваченные другими потоками (например, stdout), и процесс пула может зависнуть.
+# forkserver форкает их от отдельного однопоточного процесса с уже импортированным pandas
+if 'forkserver' in multiprocessing.get_all_start_methods():
+    POOL_CONTEXT = multiprocessing.get_context('forkserver')
+    POOL_CONTEXT.set_forkserver_preload(['processsing'])
+else:
+    POOL_CONTEXT = multiprocessing.get_context('spawn')
+
+# Столбцы с датами и форматы, в которых их отдаёт система бронирования (проверяются по порядку)
+DATE_COLUMNS = ['creation_date', 'checkin_date']
+DATE_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d.%m.%Y']
+
+# Даты Excel хранятся как число дней от 30.12.1899
+EXCEL_EPOCH = pd.Timestamp('1899-12-30')
+EXCEL_SERIAL_RANGE = (1, 2958465)  # 01.01.1900 - 31.12.9999
+
+# Статусы удалённых/аннулированных путевок (в результат не попадают)
+CANCELLED_STATUSES = ['Удален', 'Аннулирован', 'удален', 'аннулирован']
 
 
 def reset_stats():
@@ -30,17 +126,32 @@ def reset_stats():
         'extracted_regions': 0,
         'final_rows': 0,
         'final_cols': 0,
-        'added_cols': []
+        'added_cols': [],
+        'source_files': 0,
+        'parse_time_sec': 0.0,
+        'dedup_time_sec': 0.0,
+        'coerced_dates': 0,
+        'preflight_time_sec': 0.0,
+        'rows_estimate': None,
+        'history_inserted': 0,
+        'history_updated': 0,
+        'history_time_sec': 0.0,
+        'history_status': 'skipped',
+        'enrich_time_sec': 0.0,
+        'save_time_sec': 0.0,
+        'sheets_time_sec': 0.0,
+        'sheets_status': 'skipped'
     }
 
 
-def get_currency_rates(rates_file='/home/vulcan4ik/dashboard-cruise-app/app_data/currency_rates_2024-2025.csv'):
+def get_currency_rates(rates_file=RATES_FILE):
 
-    """Загружает курсы валют с кэшированием"""
-    global _CURRENCY_RATES_CACHE
+    """Загружает курсы валют с кэшированием (кэш перечитывается, если файл обновился)"""
+    global _CURRENCY_RATES_CACHE, _CURRENCY_RATES_MTIME
 
     if _CURRENCY_RATES_CACHE is not None:
-        return _CURRENCY_RATES_CACHE
+        if not os.path.exists(rates_file) or os.path.getmtime(rates_file) == _CURRENCY_RATES_MTIME:
+            return _CURRENCY_RATES_CACHE
 
     try:
         # ← ДОБАВИТЬ ЭТУ ПРОВЕРКУ:
@@ -48,9 +159,11 @@ def get_currency_rates(rates_file='/home/vulcan4ik/dashboard-cruise-app/app_data
             print(f"❌ Файл курсов не найден: {rates_file}")
             return None
 
+        rates_mtime = os.path.getmtime(rates_file)
         rates_df = pd.read_csv(rates_file)
         rates_df['date'] = pd.to_datetime(rates_df['date'])
         _CURRENCY_RATES_CACHE = rates_df
+        _CURRENCY_RATES_MTIME = rates_mtime
         print(f"✅ Курсы валют загружены: {len(rates_df)} записей")
         print(f"📅 Период курсов: {rates_df['date'].min().date()} - {rates_df['date'].max().date()}")
         return rates_df
@@ -145,31 +258,262 @@ def clean_numeric_data(df):
 
     # Применяем ко всем столбцам, которые выглядят как числовые
     for column in df.columns:
-        # Проверяем, есть ли в столбце строки с запятыми
-        has_commas = df[column].apply(lambda x: ',' in str(x) if pd.notna(x) else False).any()
+        # В числовых и датах запятых быть не может
+        if pd.api.types.is_numeric_dtype(df[column]) or pd.api.types.is_datetime64_any_dtype(df[column]):
+            continue
+
+        # Проверяем, есть ли в столбце строки с запятыми: у строковых столбцов векторно,
+        # у смешанных (bool, None, числа вперемешку) - по значениям, .str к ним неприменим
+        if pd.api.types.infer_dtype(df[column], skipna=True) in ('string', 'empty'):
+            has_commas = df[column].str.contains(',', regex=False).eq(True).any()
+        else:
+            has_commas = df[column].apply(lambda x: ',' in str(x) if pd.notna(x) else False).any()
 
+        # Перезаписывается только этот столбец, остальные остаются общими с исходным DataFrame
         if has_commas:
             df[column] = df[column].apply(convert_numeric_value)
 
     return df
 
 
-def process_data(file_path):
-    """Основная функция обработки данных"""
+def split_source(source):
+    """
+    Источник - путь к файлу или пара (имя файла, путь или поток)
+    Возвращает: (имя файла, данные для pandas)
+    """
+    if isinstance(source, tuple):
+        return source
+    return source, source
+
+
+def is_pipeline_column(name):
+    """Нужен ли столбец пайплайну (до или после переименования)"""
+    return name in COLUMN_RENAMES or name in COLUMN_RENAME_TARGETS
+
+
+def _source_size(data):
+    """Размер файла или потока в байтах"""
+    if isinstance(data, str):
+        return os.path.getsize(data)
+    data.seek(0, os.SEEK_END)
+    size = data.tell()
+    data.seek(0)
+    return size
+
+
+def _estimate_csv_rows(data):
+    """Оценка числа строк CSV по средней длине строки в начале файла"""
+    size = _source_size(data)
+    if isinstance(data, str):
+        with open(data, 'rb') as f:
+            sample = f.read(ROW_ESTIMATE_SAMPLE_BYTES)
+    else:
+        sample = data.read(ROW_ESTIMATE_SAMPLE_BYTES)
+        data.seek(0)
+
+    lines = sample.count(b'\n')
+    if lines == 0:
+        return 0
+    if len(sample) >= size:
+        return max(lines - 1, 0)
+    return int(size / (len(sample) / lines)) - 1
+
+
+def sniff_source(source):
+    """
+    Читает только заголовок выгрузки (для Excel - ещё размер первого листа)
+    Возвращает: {'columns': [...], 'rows_estimate': число строк или None}
+    """
+    filename, data = split_source(source)
+    if not isinstance(data, str):
+        data.seek(0)
+
+    lower = filename.lower()
+    if lower.endswith('.csv'):
+        columns = list(pd.read_csv(data, nrows=0).columns)
+        if not isinstance(data, str):
+            data.seek(0)
+        rows_estimate = _estimate_csv_rows(data)
+
+    elif lower.endswith('.xlsx'):
+        from openpyxl import load_workbook
+
+        # read_only: openpyxl не разбирает лист целиком, размер берётся из <dimension>
+        workbook = load_workbook(data, read_only=True)
+        try:
+            sheet = workbook.worksheets[0]
+            header = next(sheet.iter_rows(min_row=1, max_row=1, values_only=True), ())
+            columns = [str(value) for value in header if value is not None]
+            rows_estimate = sheet.max_row - 1 if sheet.max_row else None
+        finally:
+            workbook.close()
+        if not isinstance(data, str):
+            data.seek(0)
+
+    else:
+        # .xls читается xlrd целиком - заголовок без оценки размера
+        columns = list(pd.read_excel(data, nrows=0).columns)
+        rows_estimate = None
+        if not isinstance(data, str):
+            data.seek(0)
+
+    return {'columns': columns, 'rows_estimate': rows_estimate}
+
+
+def validate_header(filename, columns):
+    """Проверяет, что в выгрузке есть обязательные столбцы; иначе ValueError со списками столбцов"""
+    present = set(columns)
+    missing = [column for column in REQUIRED_COLUMNS
+               if column not in present and COLUMN_RENAMES[column] not in present]
+    if not missing:
+        return
+
+    unexpected = [column for column in columns if not is_pipeline_column(column)]
+    message = f"Файл {os.path.basename(filename)} не похож на выгрузку путевок: нет столбцов {', '.join(missing)}"
+    if unexpected:
+        shown = ', '.join(unexpected[:10])
+        more = f' и ещё {len(unexpected) - 10}' if len(unexpected) > 10 else ''
+        message += f". Неизвестные столбцы: {shown}{more}"
+    raise ValueError(message)
+
+
+def read_source(source, low_memory=False, header=None):
+    """
+    Читает одну выгрузку (CSV или Excel) из пути или из потока
+    low_memory: читать только нужные пайплайну столбцы
+    header: результат sniff_source, если заголовок уже прочитан
+    Возвращает: (DataFrame, список всех столбцов файла)
+    """
+    filename, data = split_source(source)
+    if isinstance(data, bytes):
+        # Байты приходят из read_sources вместо потока, который нельзя передать в процесс
+        data = io.BytesIO(data)
+        source = (filename, data)
+    is_csv = filename.lower().endswith('.csv')
+    reader = pd.read_csv if is_csv else pd.read_excel
+
+    if header is None:
+        header = sniff_source(source)
+    if not isinstance(data, str):
+        data.seek(0)
+
+    usecols = is_pipeline_column if low_memory else None
+
+    rows_estimate = header['rows_estimate'] or 0
+    if is_csv and rows_estimate > STREAMING_ROWS_THRESHOLD:
+        # Большой CSV читаем кусками: буферы парсера ограничены размером куска
+        print(f"📦 {os.path.basename(filename)}: ~{rows_estimate} строк, чтение кусками по {CSV_CHUNK_ROWS}")
+        chunks = pd.read_csv(data, usecols=usecols, chunksize=CSV_CHUNK_ROWS)
+        return pd.concat(chunks, ignore_index=True), header['columns']
+
+    return reader(data, usecols=usecols), header['columns']
+
+
+def _process_source(source, temp_paths):
+    """
+    Источник, который можно передать в процесс пула: поток загрузки заменяется байтами,
+    а большой - временным файлом (его путь добавляется в temp_paths для удаления)
+    """
+    filename, data = split_source(source)
+    if isinstance(data, str):
+        return source
+
+    if _source_size(data) <= EXCEL_BYTES_MAX:
+        return filename, data.read()
+
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(filename)[1], delete=False) as f:
+        shutil.copyfileobj(data, f, 1024 * 1024)
+    temp_paths.append(f.name)
+    return filename, f.name
+
+
+def read_sources(sources, low_memory=False, headers=None):
+    """
+    Читает несколько выгрузок параллельно и объединяет в один DataFrame
+    headers: заголовки файлов из sniff_source (в том же порядке)
+    Возвращает: (DataFrame, список всех столбцов исходных файлов)
+    """
+    if headers is None:
+        headers = [None] * len(sources)
+
+    if len(sources) == 1:
+        return read_source(sources[0], low_memory, headers[0])
+
+    max_workers = min(len(sources), os.cpu_count() or 1)
+    temp_paths = []
+    try:
+        # Разбор Excel (openpyxl) - чистый Python под GIL, поэтому Excel читаем в процессах;
+        # CSV (путь или поток) - в потоках: парсер pandas отпускает GIL, а DataFrame
+        # из процесса пришлось бы целиком передавать обратно через pipe
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=POOL_CONTEXT) as processes, \
+                ThreadPoolExecutor(max_workers=max_workers) as threads:
+            futures = []
+            for source, header in zip(sources, headers):
+                if split_source(source)[0].lower().endswith('.csv'):
+                    futures.append(threads.submit(read_source, source, low_memory, header))
+                else:
+                    futures.append(processes.submit(
+                        read_source, _process_source(source, temp_paths), low_memory, header
+                    ))
+            results = [future.result() for future in futures]
+    except (BrokenProcessPool, OSError) as e:
+        # Пул не запустился или упал (например, под uWSGI sys.executable - не python):
+        # параллельное чтение - только ускорение, поэтому читаем файлы по очереди здесь
+        print(f"⚠️ Пул процессов недоступен ({e}), файлы читаются в этом процессе")
+        results = [read_source(source, low_memory, header) for source, header in zip(sources, headers)]
+    finally:
+        for path in temp_paths:
+            os.remove(path)
+
+    for source, (frame, _) in zip(sources, results):
+        print(f"📄 {os.path.basename(split_source(source)[0])}: {len(frame)} строк")
+
+    # Объединение столбцов всех файлов в порядке появления
+    columns = list(dict.fromkeys(column for _, file_columns in results for column in file_columns))
+
+    return pd.concat([frame for frame, _ in results], ignore_index=True), columns
+
+
+def process_data(sources, low_memory=LOW_MEMORY_PIPELINE):
+    """
+    Основная функция обработки данных
+    sources: путь, пара (имя файла, поток) или список таких источников
+    low_memory: не читать столбцы выгрузки, которые не нужны пайплайну
+    """
     global PROCESSING_STATS
     reset_stats()
 
-    # Читаем файл
-    if file_path.endswith('.csv'):
-        df = pd.read_csv(file_path)
-    else:
-        df = pd.read_excel(file_path)
+    if not isinstance(sources, list):
+        sources = [sources]
+
+    # Проверяем заголовки до чтения: чужой отчёт отклоняется без разбора всего файла
+    preflight_start = time.perf_counter()
+    _PROGRESS.stage('preflight')
+    headers = [sniff_source(source) for source in sources]
+    for source, header in zip(sources, headers):
+        validate_header(split_source(source)[0], header['columns'])
+    estimates = [header['rows_estimate'] for header in headers]
+    if all(estimate is not None for estimate in estimates):
+        PROCESSING_STATS['rows_estimate'] = sum(estimates)
+    PROCESSING_STATS['preflight_time_sec'] = round(time.perf_counter() - preflight_start, 3)
+    print(f"🔎 Проверка заголовков: {PROCESSING_STATS['preflight_time_sec']} сек, "
+          f"оценка строк: {PROCESSING_STATS['rows_estimate'] or 'нет'}")
+
+    # Читаем файлы
+    parse_start = time.perf_counter()
+    _PROGRESS.stage('parse')
+    df, source_columns = read_sources(sources, low_memory, headers)
+    PROCESSING_STATS['source_files'] = len(sources)
+    PROCESSING_STATS['parse_time_sec'] = round(time.perf_counter() - parse_start, 3)
+    print(f"⏱️ Чтение файлов ({len(sources)} шт.): {PROCESSING_STATS['parse_time_sec']} сек")
 
     # Сохраняем исходную статистику
     PROCESSING_STATS['original_rows'] = len(df)
-    PROCESSING_STATS['original_cols'] = len(df.columns)
+    PROCESSING_STATS['original_cols'] = len(source_columns)
 
-    print(f"📂 Исходный файл: {len(df)} строк, {len(df.columns)} столбцов")
+    print(f"📂 Исходный файл: {len(df)} строк, {len(source_columns)} столбцов")
+
+    _PROGRESS.stage('clean')
 
     # ПЕРВЫМ ДЕЛОМ - переименовываем столбцы
     df = rename_columns(df)
@@ -177,15 +521,30 @@ def process_data(file_path):
     # Затем очищаем числовые данные
     df = clean_numeric_data(df)
 
+    # Номер путевки - ключ дубликатов и истории: приводим к строке один раз
+    df = normalize_voucher_ids(df)
+
     # Обработка данных (БЕЗ генерации)
-    df = clean_data(df)
+    # Строки не копируем на каждом шаге: собираем одну маску и применяем её один раз
+    # Аннулирование проверяем у самой свежей записи путевки: устаревшая активная запись
+    # из другой выгрузки не должна остаться, если в новой путевка аннулирована
+    keep = clean_data_mask(df)
+    df = normalize_dates(df, keep)
+    keep &= duplicates_mask(df, keep)
+    keep &= status_mask(df, keep)
+    df = df[keep]
+    print(f"📊 Итоговый размер данных: {df.shape}")
+
     df = fill_missing_buyer_names(df)
+
+    enrich_start = time.perf_counter()
     df = enrich_data(df)
+    PROCESSING_STATS['enrich_time_sec'] = round(time.perf_counter() - enrich_start, 3)
 
     # Финальная статистика
     PROCESSING_STATS['final_rows'] = len(df)
     PROCESSING_STATS['final_cols'] = len(df.columns)
-    PROCESSING_STATS['added_cols'] = ['amount_rub', 'region', 'is_cruise_seller', 'payment_percentage', 'days_until_checkin', 'creation_month']
+    PROCESSING_STATS['added_cols'] = list(ENRICHED_COLUMNS)
 
     print(f"✅ Обработка завершена: {len(df)} строк, {len(df.columns)} столбцов")
 
@@ -194,32 +553,18 @@ def process_data(file_path):
 
 def rename_columns(df):
     """Переименование столбцов согласно словарю"""
-    rename_dict = {
-        'Путевка': 'voucher_id',
-        'Страна': 'country',
-        'Дата создания': 'creation_date',
-        'Дата заезда': 'checkin_date',
-        'Дней': 'days',
-        'Человек': 'people',
-        'Статус путевки': 'voucher_status',
-        'Внутренний статус': 'internal_status',
-        'Валюта': 'currency',
-        'Сумма к оплате': 'amount_to_pay',
-        'Оплата': 'payment',
-        'Название тура': 'tour_name',
-        'Покупатель: Ответственное подразделение': 'buyer_department',
-        'Покупатель: Наименование': 'buyer_name',
-        'Покупатель: Категория ТА': 'buyer_category',
-        'Создатель': 'creator',
-        'Ведущий менеджер': 'manager'
-    }
 
-    # переименовываем - pandas автоматически игнорирует отсутствующие столбцы
-    df = df.rename(columns=rename_dict)
+    # Сначала оставляем только столбцы из словаря (в том числе уже переименованные),
+    # потом переименовываем - при copy-on-write ни то, ни другое не копирует данные
+    source_columns = []
+    for source, target in COLUMN_RENAMES.items():
+        if source in df.columns:
+            source_columns.append(source)
+        elif target in df.columns:
+            source_columns.append(target)
 
-    # Оставляем только столбцы из словаря (те которые существуют после переименования)
-    final_columns = [v for v in rename_dict.values() if v in df.columns]
-    df = df[final_columns]
+    df = df[source_columns].rename(columns=COLUMN_RENAMES)
+    final_columns = list(df.columns)
 
     print(f"✅ Переименовано столбцов: {len(final_columns)}")
     print(f"📋 Итоговые столбцы: {list(df.columns)}")
@@ -227,37 +572,186 @@ def rename_columns(df):
     return df
 
 
-def clean_data(df):
-    """Очистка данных"""
+def normalize_voucher_ids(df):
+    """
+    Приводит voucher_id к строке без пробелов по краям (пропуски остаются пропусками);
+    этот же столбец - ключ в duplicates_mask и в истории путевок
+    """
+    if 'voucher_id' not in df.columns:
+        return df
+
+    voucher_id = df['voucher_id']
+    if pd.api.types.infer_dtype(voucher_id, skipna=True) in ('string', 'empty'):
+        df['voucher_id'] = voucher_id.str.strip()
+    else:
+        # Номера числами или вперемешку со строками - в том виде, который даёт str()
+        df['voucher_id'] = voucher_id.astype(str).str.strip().where(voucher_id.notna())
+
+    return df
+
+
+def clean_data_mask(df):
+    """
+    Маска строк с непустым voucher_id (сами строки не копируются)
+    Статус путевки здесь не проверяется: сначала по всем строкам ищется самая свежая
+    запись путевки (duplicates_mask), и только она проверяется на аннулирование (status_mask)
+    """
     global PROCESSING_STATS
 
     print(f"🔍 Исходный размер данных: {df.shape}")
 
-    # Удаляем строки с удаленными/аннулированными путевками
-    initial_count = len(df)
-    df = df[~df['voucher_status'].isin(['Удален', 'Аннулирован', 'удален', 'аннулирован'])]
-    PROCESSING_STATS['removed_cancelled'] = initial_count - len(df)
-    print(f"🔍 Размер данных после удаления аннулированных/удаленных: {df.shape}")
+    keep = pd.Series(True, index=df.index)
 
     # Удаляем строки с пустым voucher_id (включая последние строки)
+    # Пробелы по краям уже убраны в normalize_voucher_ids
     if 'voucher_id' in df.columns:
-        initial_count = len(df)
-        # Создаем маску для непустых voucher_id
-        non_empty_mask = (
-            df['voucher_id'].notna() &
-            (df['voucher_id'] != '') &
-            (df['voucher_id'].astype(str).str.strip() != '')
-        )
-        df = df[non_empty_mask]
-        removed_count = initial_count - len(df)
+        voucher_id = df['voucher_id']
+        empty = voucher_id.isna() | voucher_id.eq('')
+
+        removed_count = int(empty.sum())
+        keep &= ~empty
         PROCESSING_STATS['removed_empty_voucher'] = removed_count
         if removed_count > 0:
             print(f"🗑️ Удалено строк с пустым voucher_id: {removed_count}")
 
-    print(f"📊 Итоговый размер данных: {df.shape}")
+    return keep
+
+
+def status_mask(df, keep):
+    """Маска без удалённых/аннулированных путевок среди строк keep"""
+    global PROCESSING_STATS
+
+    cancelled = df['voucher_status'].isin(CANCELLED_STATUSES)
+    PROCESSING_STATS['removed_cancelled'] = int((keep & cancelled).sum())
+    print(f"🔍 Строк после удаления аннулированных/удаленных: {int((keep & ~cancelled).sum())}")
+    return ~cancelled
+
+
+def parse_dates(values):
+    """
+    Разбирает столбец дат: сначала известные форматы выгрузок и даты Excel,
+    угадывание формата - только для строк, которые ни под один не подошли
+    Возвращает: (Series datetime64, маска непустых значений, ставших NaT)
+    """
+    failed = pd.Series(False, index=values.index)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values, failed
+
+    result = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    pending = values.notna()
+
+    # Известные форматы: каждый следующий пробуем только на оставшихся строках
+    if not pd.api.types.is_numeric_dtype(values):
+        for date_format in DATE_FORMATS:
+            if not pending.any():
+                break
+            parsed = pd.to_datetime(values[pending], format=date_format, errors='coerce')
+            parsed = parsed[parsed.notna()]
+            result[parsed.index] = parsed
+            pending[parsed.index] = False
+
+    # Даты Excel в виде числа дней
+    numbers = pd.to_numeric(values[pending], errors='coerce').dropna()
+    serials = numbers[numbers.between(*EXCEL_SERIAL_RANGE)]
+    if len(serials):
+        result[serials.index] = EXCEL_EPOCH + pd.to_timedelta(serials, unit='D')
+    pending[serials.index] = False
+
+    # Числа вне диапазона дат - ошибка, а строки из цифр ('20251001') идут на угадывание формата
+    out_of_range = values[numbers.index.difference(serials.index)]
+    not_text = out_of_range.index[~out_of_range.map(lambda value: isinstance(value, str)).astype(bool)]
+    pending[not_text] = False
+    failed[not_text] = True
+
+    # Всё остальное - с угадыванием формата для каждого значения
+    if pending.any():
+        leftovers = values[pending]
+        # Пустые строки - это пропуски, а не ошибки разбора
+        leftovers = leftovers[leftovers.astype(str).str.strip() != '']
+        parsed = pd.to_datetime(leftovers, format='mixed', errors='coerce')
+        result[parsed.index] = parsed
+        failed[parsed.index[parsed.isna()]] = True
+
+    return result, failed
+
+
+def month_keys(dates):
+    """Ключ месяца 'ГГГГ-ММ': строки собираются только для уникальных месяцев"""
+    keys = dates.dt.year * 100 + dates.dt.month
+    codes, uniques = pd.factorize(keys)
+
+    # Код -1 (пустая дата) попадает на последний элемент - NaN
+    labels = np.array([f"{int(key) // 100:04d}-{int(key) % 100:02d}" for key in uniques] + [np.nan], dtype=object)
+    return pd.Series(labels[codes], index=dates.index)
+
+
+def normalize_dates(df, keep=None):
+    """
+    Приводит столбцы дат к datetime (один раз за весь пайплайн)
+    keep: маска строк, которые попадут в результат - ошибки считаем только по ним
+    """
+    global PROCESSING_STATS
+
+    for column in DATE_COLUMNS:
+        if column not in df.columns:
+            continue
+
+        df[column], failed = parse_dates(df[column])
+        if keep is not None:
+            failed &= keep
+        coerced = int(failed.sum())
+        PROCESSING_STATS['coerced_dates'] += coerced
+        if coerced > 0:
+            print(f"⚠️ Не удалось распознать даты в {column}: {coerced} значений")
+
     return df
 
 
+def duplicates_mask(df, keep):
+    """
+    Маска без повторов путевок среди строк keep: остаётся запись
+    с самой поздней датой создания; при равных датах (у путевки в выгрузках разных
+    филиалов дата одна и та же) - аннулированная/удалённая, так как аннулирование
+    окончательное. Так результат не зависит от порядка загружаемых файлов
+    """
+    global PROCESSING_STATS
+
+    mask = pd.Series(True, index=df.index)
+    if 'voucher_id' not in df.columns:
+        return mask
+
+    dedup_start = time.perf_counter()
+
+    # Номера уже приведены к строке в normalize_voucher_ids - ключ берём как есть
+    keys = df['voucher_id'][keep]
+
+    # После стабильной сортировки по дате (пустые первыми), а при равной дате - по признаку
+    # аннулирования, выбранная запись путевки идёт последней (даты уже разобраны в normalize_dates)
+    sort_keys = []
+    if 'voucher_status' in df.columns:
+        sort_keys.append(df['voucher_status'][keep].isin(CANCELLED_STATUSES).to_numpy())
+    if 'creation_date' in df.columns:
+        # NaT в int64 - наименьшее значение
+        sort_keys.append(df['creation_date'][keep].to_numpy(dtype='datetime64[ns]').view('int64'))
+    if sort_keys:
+        # lexsort устойчивый, главный ключ - последний
+        keys = keys.iloc[np.lexsort(sort_keys)]
+
+    # duplicated() работает по хэш-таблице, без попарных сравнений
+    duplicated = keys.duplicated(keep='last')
+    mask[duplicated.index[duplicated.to_numpy()]] = False
+
+    removed_count = int(duplicated.sum())
+    PROCESSING_STATS['removed_duplicates'] = removed_count
+    PROCESSING_STATS['dedup_time_sec'] = round(time.perf_counter() - dedup_start, 3)
+
+    if removed_count > 0:
+        print(f"🗑️ Удалено дубликатов путевок: {removed_count}")
+    print(f"⏱️ Удаление дубликатов: {PROCESSING_STATS['dedup_time_sec']} сек")
+
+    return mask
+
+
 def fill_missing_buyer_names(df):
     """Заполняет пропуски в buyer_name: КЛИЕНТСКИЙ ЗАЛ или 'Не определен'"""
     global PROCESSING_STATS
@@ -290,6 +784,65 @@ def fill_missing_buyer_names(df):
     return df
 
 
+# Таблицы поиска региона: строятся один раз при импорте (и до fork в gunicorn)
+# Расширенный список городов с приоритетом
+REGION_CITIES = {
+    'Москва': ['москва', 'мск', 'moscow'],
+    'Санкт-Петербург': ['санкт-петербург', 'спб', 'питер', 'st. petersburg', 'petersburg'],
+    'Новосибирск': ['новосибирск', 'новосиб'],
+    'Екатеринбург': ['екатеринбург', 'екб'],
+    'Казань': ['казань', 'kazan'],
+    'Краснодар': ['краснодар'],
+    'Пермь': ['пермь', 'perm'],
+    'Ростов-на-Дону': ['ростов-на-дону', 'ростов'],
+    'Тюмень': ['тюмень'],
+    'Барнаул': ['барнаул'],
+    'Красноярск': ['красноярск'],
+    'Владивосток': ['владивосток', 'vladivostok'],
+    'Самара': ['самара', 'samara'],
+    'Минск': ['минск', 'minsk'],
+    'Бишкек': ['бишкек', 'bishkek'],
+    'Астана': ['астана', 'astana'],
+    'Сочи': ['сочи', 'sochi'],
+    'Ярославль': ['ярославль'],
+    'Воронеж': ['воронеж'],
+    'Иркутск': ['иркутск'],
+    'Хабаровск': ['хабаровск'],
+    'Ставрополь': ['ставрополь'],
+    'Челябинск': ['челябинск'],
+    'Новороссийск': ['новороссийск'],
+    'Томск': ['томск'],
+    'Киев': ['киев', 'kyiv'],
+    'Ташкент': ['ташкент', 'tashkent'],
+    'Ереван': ['ереван', 'yerevan'],
+    'Баку': ['баку', 'baku'],
+    'Алматы': ['алматы', 'almaty'],
+}
+
+# Пары (вариант написания, город) в порядке приоритета
+REGION_CITY_VARIANTS = tuple(
+    (variant, city) for city, variants in REGION_CITIES.items() for variant in variants
+)
+
+# Расширенный список стоп-слов
+REGION_STOP_WORDS = frozenset({
+    'ИП', 'ТРЕВЕЛ', 'ГРУПП', 'ТУР', 'ВОЯЖ', 'КОРАЛ', 'АНЕКС', 'PAC', 'ПАК',
+    'TRAVEL', 'GROUP', 'ООО', 'ЗАО', 'АО', 'LTD', 'CORP', 'COMPANY', 'CLUB',
+    'м.', 'ул.', 'пр.', 'бульвар', 'проспект', 'улица', 'ЦЕНТР', 'ОФИС', 'ОТДЕЛ',
+    'ФИЛИАЛ', 'АГЕНТСТВО', 'БЮРО', 'СЕТЬ', 'КОМПАНИЯ', 'EXPERT', 'EXPERTS',
+    'WORLD', 'INTERNATIONAL', 'SERVICE', 'SERVICES', 'КРУКЛАБ', 'АЛЛИНТРЭВЕЛ',
+    'ГЕРМЕС', 'САНЭКСПРЕСС-ГП', 'МА МИЛЬЯНА', 'КРУГОЗОР', 'ПРАЙМ', 'ЭДЕМ-СЕРВИС',
+    'БУТИК ПУТЕШЕСТВИЙ', 'АП АРФА', 'КРАСКИ МИРА', 'БОНЖУР', 'МЕРИДИАН',
+    'ДИРЕКТОРИУМ', 'РЕГИОН', 'ВОЛГА', 'СИБИРЬ', 'УРАЛ', 'ДАЛЬНИЙ ВОСТОК'
+})
+
+# Общие слова, которые не могут быть городом
+REGION_COMMON_WORDS = frozenset({'ТУРИЗМ', 'ОТДЫХ', 'ПУТЕШЕСТВИЙ', 'ТУРОВ', 'ВОЯЖ', 'ТРЕВЕЛ'})
+
+_REGION_SPLIT_RE = re.compile(r'[,;]')
+_REGION_NAME_RE = re.compile(r'^[А-ЯЁа-яёA-Za-z\- ]+$')
+
+
 def extract_region(agency_name):
     """Извлекает регион из названия агентства"""
     if not isinstance(agency_name, str) or agency_name.strip() == '' or agency_name.lower() in ['n/a', 'nan', 'none']:
@@ -297,113 +850,65 @@ def extract_region(agency_name):
 
     text = agency_name.strip()
 
-    # Расширенный список городов с приоритетом
-    known_cities = {
-        'Москва': ['москва', 'мск', 'moscow'],
-        'Санкт-Петербург': ['санкт-петербург', 'спб', 'питер', 'st. petersburg', 'petersburg'],
-        'Новосибирск': ['новосибирск', 'новосиб'],
-        'Екатеринбург': ['екатеринбург', 'екб'],
-        'Казань': ['казань', 'kazan'],
-        'Краснодар': ['краснодар'],
-        'Пермь': ['пермь', 'perm'],
-        'Ростов-на-Дону': ['ростов-на-дону', 'ростов'],
-        'Тюмень': ['тюмень'],
-        'Барнаул': ['барнаул'],
-        'Красноярск': ['красноярск'],
-        'Владивосток': ['владивосток', 'vladivostok'],
-        'Самара': ['самара', 'samara'],
-        'Минск': ['минск', 'minsk'],
-        'Бишкек': ['бишкек', 'bishkek'],
-        'Астана': ['астана', 'astana'],
-        'Сочи': ['сочи', 'sochi'],
-        'Ярославль': ['ярославль'],
-        'Воронеж': ['воронеж'],
-        'Иркутск': ['иркутск'],
-        'Хабаровск': ['хабаровск'],
-        'Ставрополь': ['ставрополь'],
-        'Челябинск': ['челябинск'],
-        'Новороссийск': ['новороссийск'],
-        'Томск': ['томск'],
-        'Киев': ['киев', 'kyiv'],
-        'Ташкент': ['ташкент', 'tashkent'],
-        'Ереван': ['ереван', 'yerevan'],
-        'Баку': ['баку', 'baku'],
-        'Алматы': ['алматы', 'almaty'],
-    }
-
     # Сначала ищем известные города в любом месте строки
-    for city, variants in known_cities.items():
-        for variant in variants:
-            if variant in text.lower():
-                return city
+    text_lower = text.lower()
+    for variant, city in REGION_CITY_VARIANTS:
+        if variant in text_lower:
+            return city
 
     # Если город не найден, парсим структуру (только последний элемент после запятой)
-    parts = [p.strip() for p in re.split(r'[,;]', text) if p.strip()]
+    parts = [p.strip() for p in _REGION_SPLIT_RE.split(text) if p.strip()]
 
     if len(parts) > 1:
         # Берем последнюю часть (обычно там город)
         last_part = parts[-1]
-
-        # Расширенный список стоп-слов
-        stop_words = {
-            'ИП', 'ТРЕВЕЛ', 'ГРУПП', 'ТУР', 'ВОЯЖ', 'КОРАЛ', 'АНЕКС', 'PAC', 'ПАК',
-            'TRAVEL', 'GROUP', 'ООО', 'ЗАО', 'АО', 'LTD', 'CORP', 'COMPANY', 'CLUB',
-            'м.', 'ул.', 'пр.', 'бульвар', 'проспект', 'улица', 'ЦЕНТР', 'ОФИС', 'ОТДЕЛ',
-            'ФИЛИАЛ', 'АГЕНТСТВО', 'БЮРО', 'СЕТЬ', 'КОМПАНИЯ', 'EXPERT', 'EXPERTS',
-            'WORLD', 'INTERNATIONAL', 'SERVICE', 'SERVICES', 'КРУКЛАБ', 'АЛЛИНТРЭВЕЛ',
-            'ГЕРМЕС', 'САНЭКСПРЕСС-ГП', 'МА МИЛЬЯНА', 'КРУГОЗОР', 'ПРАЙМ', 'ЭДЕМ-СЕРВИС',
-            'БУТИК ПУТЕШЕСТВИЙ', 'АП АРФА', 'КРАСКИ МИРА', 'БОНЖУР', 'МЕРИДИАН',
-            'ДИРЕКТОРИУМ', 'РЕГИОН', 'ВОЛГА', 'СИБИРЬ', 'УРАЛ', 'ДАЛЬНИЙ ВОСТОК'
-        }
+        last_part_upper = last_part.upper()
 
         # Проверяем, что это не стоп-слово и похоже на географическое название
-        if (not any(stop_word in last_part.upper() for stop_word in stop_words) and
+        if (not any(stop_word in last_part_upper for stop_word in REGION_STOP_WORDS) and
             len(last_part) >= 3 and
             not last_part.isdigit() and
-            re.match(r'^[А-ЯЁа-яёA-Za-z\- ]+$', last_part)):
+            _REGION_NAME_RE.match(last_part)):
 
             # Дополнительная проверка - не должно быть общих слов
-            common_words = {'ТУРИЗМ', 'ОТДЫХ', 'ПУТЕШЕСТВИЙ', 'ТУРОВ', 'ВОЯЖ', 'ТРЕВЕЛ'}
-            if not any(word in last_part.upper() for word in common_words):
+            if not any(word in last_part_upper for word in REGION_COMMON_WORDS):
                 return last_part.strip()
 
     return 'Другой'
 
 
-def enrich_data(df):
-
+def _enrich_partition(df, rates_df, now, reporter=None):
+    """
+    Обогащает часть строк; вызывается в процессе пула или напрямую
+    reporter: прогресс по строкам (только на одном ядре, из пула не передаётся)
+    Возвращает: (DataFrame, частичная статистика)
+    """
     global PROCESSING_STATS
 
-    print(f"🔄 Начало обогащения данных...")
-
-
-    # Преобразуем даты в datetime формат
-    if 'creation_date' in df.columns:
-        df['creation_date'] = pd.to_datetime(df['creation_date'], errors='coerce')
-
-    if 'checkin_date' in df.columns:
-        df['checkin_date'] = pd.to_datetime(df['checkin_date'], errors='coerce')
+    if reporter is None:
+        reporter = progress.ProgressReporter()
 
-    # Загружаем курсы перед конвертацией
-    rates_df = get_currency_rates()
+    # convert_to_rub считает конвертации в глобальной статистике процесса - берём прирост
+    converted_before = PROCESSING_STATS.setdefault('converted_currency', 0)
 
     if rates_df is None:
-        print(f"⚠️  Курсы валют не загружены, конвертация пропущена")
         df['amount_rub'] = 0
     else:
-        # передаём rates_df в функцию
-        print(f"💱 Начало конвертации валют...")
-        df['amount_rub'] = df.apply(
-            lambda row: convert_to_rub(row, rates_df),
+        # apply по строкам собирает объектный массив из всех переданных столбцов,
+        # поэтому передаём только те, что нужны convert_to_rub
+        conversion_columns = [c for c in ['amount_to_pay', 'currency', 'creation_date'] if c in df.columns]
+        reporter.stage('convert', total=len(df))
+        df['amount_rub'] = df[conversion_columns].apply(
+            reporter.counted(lambda row: convert_to_rub(row, rates_df)),
             axis=1
         )
-        print(f"✅ Конвертировано строк: {PROCESSING_STATS['converted_currency']}")
 
     # Извлечение региона из страны (если нужно)
+    extracted_regions = 0
     if 'country' in df.columns:
-        print(f"🌍 Извлечение регионов...")
-        df['region'] = df['country'].apply(extract_region)
-        PROCESSING_STATS['extracted_regions'] = df['region'].notna().sum()
+        reporter.stage('regions', total=len(df))
+        df['region'] = df['country'].apply(reporter.counted(extract_region))
+        extracted_regions = int(df['region'].notna().sum())
     else:
         df['region'] = 'Неизвестно'
 
@@ -420,49 +925,141 @@ def enrich_data(df):
             (df.loc[mask, 'payment'] / df.loc[mask, 'amount_rub'] * 100).round(2)
         )
 
-    # Дни до заезда
+    # Дни до заезда (now одно на весь файл, чтобы части не расходились)
     if 'checkin_date' in df.columns:
-        df['checkin_date'] = pd.to_datetime(df['checkin_date'], errors='coerce')
-        df['days_until_checkin'] = (df['checkin_date'] - pd.Timestamp.now()).dt.days
+        df['days_until_checkin'] = (df['checkin_date'] - now).dt.days
     else:
         df['days_until_checkin'] = 0
 
     # Месяц создания
     if 'creation_date' in df.columns:
-        df['creation_date'] = pd.to_datetime(df['creation_date'], errors='coerce')
-        df['creation_month'] = df['creation_date'].dt.strftime('%Y-%m')
+        df['creation_month'] = month_keys(df['creation_date'])
     else:
         df['creation_month'] = 'Неизвестно'
 
+    stats = {
+        'converted_currency': PROCESSING_STATS['converted_currency'] - converted_before,
+        'extracted_regions': extracted_regions
+    }
+    return df, stats
+
+
+def _enrich_partition_worker(args):
+    """Точка входа процесса пула: курсы берутся из кэша, заполненного инициализатором"""
+    df, now = args
+    return _enrich_partition(df, _CURRENCY_RATES_CACHE, now)
+
+
+def _init_enrich_worker(rates_df):
+    """Курсы передаются в процесс один раз, а не с каждой частью"""
+    global _CURRENCY_RATES_CACHE
+    _CURRENCY_RATES_CACHE = rates_df
+
+
+def enrich_data(df, workers=None):
+    """
+    Добавляет расчётные столбцы
+    workers: число процессов (по умолчанию ENRICH_WORKERS); маленькие файлы всегда на одном ядре
+    """
+    global PROCESSING_STATS
+
+    print(f"🔄 Начало обогащения данных...")
+
+    # Загружаем курсы перед конвертацией
+    rates_df = get_currency_rates()
+    if rates_df is None:
+        print(f"⚠️  Курсы валют не загружены, конвертация пропущена")
+
+    now = pd.Timestamp.now()
+    workers = ENRICH_WORKERS if workers is None else workers
+    workers = min(workers, len(df) // ENRICH_MIN_PARTITION_ROWS) if PARALLEL_ENRICHMENT else 1
+    if len(df) < ENRICH_PARALLEL_MIN_ROWS:
+        workers = 1
+
+    partial_stats = None
+    if workers > 1:
+        # Части по строкам подряд: после concat порядок строк тот же, что на одном ядре
+        bounds = np.linspace(0, len(df), workers + 1, dtype=int)
+        partitions = [(df.iloc[start:end], now) for start, end in zip(bounds[:-1], bounds[1:])]
+        print(f"💱 Конвертация валют и регионы: {len(df)} строк, {workers} процессов")
+
+        # Процессы пула прогресс не пишут - он отмечается по готовым частям
+        _PROGRESS.stage('convert', total=len(df))
+        results = []
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT,
+                                     initializer=_init_enrich_worker, initargs=(rates_df,)) as executor:
+                for frame, stats in executor.map(_enrich_partition_worker, partitions):
+                    results.append((frame, stats))
+                    _PROGRESS.advance(len(frame))
+        except (BrokenProcessPool, OSError) as e:
+            # Пул не запустился или упал: обогащаем на одном ядре, как маленький файл
+            print(f"⚠️ Пул процессов недоступен ({e}), обогащение в этом процессе")
+        else:
+            df = pd.concat([frame for frame, _ in results])
+            partial_stats = [stats for _, stats in results]
+
+            # Конвертации в процессах пула не попали в счётчик этого процесса
+            PROCESSING_STATS['converted_currency'] += sum(stats['converted_currency'] for stats in partial_stats)
+
+    if partial_stats is None:
+        print(f"💱 Конвертация валют и регионы: {len(df)} строк, 1 процесс")
+        df, stats = _enrich_partition(df, rates_df, now, _PROGRESS)
+        partial_stats = [stats]
+
+    PROCESSING_STATS['extracted_regions'] = sum(stats['extracted_regions'] for stats in partial_stats)
+    print(f"✅ Конвертировано строк: {PROCESSING_STATS['converted_currency']}")
+
     print(f"✅ Обогащение данных завершено")
     return df
 
 
-def upload_to_sheets(df, credentials_file='/home/vulcan4ik/dashboard-cruise-app/credentials.json', spreadsheet_name=None):
+def get_sheets_client(credentials_file=CREDENTIALS_FILE):
+    """Клиент Google Sheets: gspread или фабрика из CRUISE_SHEETS_CLIENT"""
+    if SHEETS_CLIENT_FACTORY:
+        module_name, factory_name = SHEETS_CLIENT_FACTORY.split(':')
+        print(f"🧪 Используется клиент Google Sheets из {SHEETS_CLIENT_FACTORY}")
+        return getattr(importlib.import_module(module_name), factory_name)()
+
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    print(f"🔑 Используется credentials файл: {credentials_file}")
+
+    # Настройка подключения к Google Sheets
+    scope = ['https://spreadsheets.google.com/feeds',
+             'https://www.googleapis.com/auth/drive']
+    creds = Credentials.from_service_account_file(credentials_file, scopes=scope)
+    return gspread.authorize(creds)
+
+
+def upload_to_sheets(df, credentials_file=CREDENTIALS_FILE, spreadsheet_name=None):
     """
     Загрузка данных в Google Sheets с fallback на локальное сохранение
     ВСЕГДА сохраняет CSV файл для скачивания
     """
     # СНАЧАЛА всегда сохраняем локально
+    save_start = time.perf_counter()
+    _PROGRESS.stage('save')
     csv_filename = save_data_locally(df)
+    PROCESSING_STATS['save_time_sec'] = round(time.perf_counter() - save_start, 3)
 
     # ПОТОМ пробуем загрузить в Google Sheets (опционально)
     print("\n📤 Попытка загрузки в Google Sheets...")
 
+    sheets_start = time.perf_counter()
+    _PROGRESS.stage('sheets')
     try:
         # Проверяем существование файла credentials
-        if not os.path.exists(credentials_file):
+        if not SHEETS_CLIENT_FACTORY and not os.path.exists(credentials_file):
             print(f"⚠️ Файл credentials не найден: {credentials_file}")
             print("⚠️ Пропускаем загрузку в Google Sheets")
             return csv_filename
 
-        print(f"🔑 Используется credentials файл: {credentials_file}")
+        # gspread тяжёлый - импортируем только когда Sheets действительно нужен
+        import gspread
 
-        # Настройка подключения к Google Sheets
-        scope = ['https://spreadsheets.google.com/feeds',
-                 'https://www.googleapis.com/auth/drive']
-        creds = Credentials.from_service_account_file(credentials_file, scopes=scope)
-        client = gspread.authorize(creds)
+        client = get_sheets_client(credentials_file)
 
         # Используем постоянное имя таблицы
         SPREADSHEET_NAME = "Cruise_Analytics_Dashboard"
@@ -490,6 +1087,8 @@ def upload_to_sheets(df, credentials_file='/home/vulcan4ik/dashboard-cruise-app/
         # Открываем доступ
         spreadsheet.share(None, perm_type='anyone', role='reader')
 
+        PROCESSING_STATS['sheets_time_sec'] = round(time.perf_counter() - sheets_start, 3)
+        PROCESSING_STATS['sheets_status'] = 'uploaded'
         print(f"✅ Данные успешно загружены в Google Sheets!")
         print(f"📊 Ссылка: {spreadsheet.url}")
 
@@ -497,6 +1096,8 @@ def upload_to_sheets(df, credentials_file='/home/vulcan4ik/dashboard-cruise-app/
         return csv_filename
 
     except Exception as e:
+        PROCESSING_STATS['sheets_time_sec'] = round(time.perf_counter() - sheets_start, 3)
+        PROCESSING_STATS['sheets_status'] = 'failed'
         print(f"⚠️ Ошибка загрузки в Google Sheets: {str(e)}")
         print("⚠️ Продолжаем работу с локальным CSV файлом")
         # Возвращаем имя файла в любом случае
@@ -507,11 +1108,12 @@ def save_data_locally(df):
     """Сохранение данных локально"""
     try:
         # Создаем папку для результатов если не существует
-        results_dir = '/home/vulcan4ik/dashboard-cruise-app/results'
+        results_dir = RESULTS_DIR
         os.makedirs(results_dir, exist_ok=True)
 
         # Сохраняем DataFrame
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        # Микросекунды в имени: параллельные загрузки не перезаписывают результаты друг друга
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
         csv_filename = f"processed_{timestamp}.csv"
         csv_path = os.path.join(results_dir, csv_filename)
 
@@ -530,6 +1132,144 @@ def save_data_locally(df):
         raise
 
 
+def checkpoint_paths(csv_filename):
+    """Пути к контрольной точке результата: данные до обогащения и метаданные"""
+    base = os.path.join(RESULTS_DIR, csv_filename[:-len('.csv')])
+    return base + '.parquet', base + '.checkpoint.json'
+
+
+def _write_json_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def save_checkpoint(df, csv_filename):
+    """
+    Сохраняет рядом с результатом данные до обогащения (Parquet) и дату последнего курса,
+    чтобы после загрузки новых курсов пересчитать рубли без повторной загрузки файла
+    """
+    rates_df = get_currency_rates()
+    parquet_path, meta_path = checkpoint_paths(csv_filename)
+
+    base_columns = [column for column in df.columns if column not in ENRICHED_COLUMNS]
+    df[base_columns].to_parquet(parquet_path, index=False)
+
+    rates_last_date = rates_df['date'].max().strftime('%Y-%m-%d') if rates_df is not None else None
+    _write_json_atomic(meta_path, {
+        'csv': csv_filename,
+        'rows': len(df),
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'rates_last_date': rates_last_date
+    })
+    print(f"💾 Контрольная точка сохранена: {os.path.basename(parquet_path)} (курсы до {rates_last_date})")
+
+
+def _csv_number(value):
+    """Число в том виде, в котором его пишет to_csv (пропуск - пустая строка)"""
+    if pd.isna(value):
+        return ''
+    return repr(float(value))
+
+
+def _refresh_result(meta_path, rates_df, now):
+    """
+    Пересчитывает один результат, если курсы обновились после его обработки
+    Возвращает: {'result', 'rows', 'seconds'} или None, если пересчёт не нужен
+    или не завершён (загрузка ещё не записана в историю)
+    """
+    started = time.perf_counter()
+    with open(meta_path, encoding='utf-8') as f:
+        meta = json.load(f)
+
+    rates_last_date = rates_df['date'].max()
+    previous_last_date = pd.Timestamp(meta['rates_last_date']) if meta.get('rates_last_date') else None
+    if previous_last_date is not None and rates_last_date <= previous_last_date:
+        return None
+
+    csv_path = os.path.join(RESULTS_DIR, meta['csv'])
+    parquet_path, _ = checkpoint_paths(meta['csv'])
+    if not os.path.exists(csv_path) or not os.path.exists(parquet_path):
+        return None
+
+    base = pd.read_parquet(parquet_path)
+
+    # Курс по последней известной дате получили только строки, созданные позже неё
+    if previous_last_date is None:
+        affected = base['creation_date'].notna()
+    else:
+        affected = base['creation_date'] > previous_last_date
+    positions = np.flatnonzero(affected.to_numpy())
+
+    if len(positions):
+        refreshed, _ = _enrich_partition(base.iloc[positions].copy(), rates_df, now)
+
+        # Остальные значения CSV переписываем как есть - читаем всё строками
+        result = pd.read_csv(csv_path, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+        if len(result) != len(base):
+            raise ValueError(f'{meta["csv"]}: число строк не совпадает с контрольной точкой')
+
+        for column in ['amount_rub', 'payment_percentage']:
+            result.iloc[positions, result.columns.get_loc(column)] = [
+                _csv_number(value) for value in refreshed[column]
+            ]
+
+        # Подмена файла целиком: скачивание никогда не увидит наполовину записанный CSV
+        tmp_path = csv_path + '.tmp'
+        result.to_csv(tmp_path, index=False, encoding='utf-8-sig')
+        os.replace(tmp_path, csv_path)
+
+        # Контрольная точка сдвигается, только если обновились и CSV, и история:
+        # иначе история навсегда осталась бы со старыми суммами. Ошибка базы уходит
+        # в refresh_results, а CSV при следующем пересчёте заново строится из Parquet
+        history = history_store.submit_refreshed_amounts(refreshed, meta['csv']).result()
+        if not history['loaded']:
+            print(f"⏳ {meta['csv']}: загрузка ещё не записана в историю, "
+                  f"контрольная точка не сдвигается до следующего пересчёта")
+            return None
+
+    meta['rates_last_date'] = rates_last_date.strftime('%Y-%m-%d')
+    meta['refreshed_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    _write_json_atomic(meta_path, meta)
+
+    if not len(positions):
+        return None
+    return {
+        'result': meta['csv'],
+        'rows': int(len(positions)),
+        'seconds': round(time.perf_counter() - started, 3)
+    }
+
+
+def refresh_results(rates_file=RATES_FILE):
+    """
+    Пересчитывает рубли в сохранённых результатах после загрузки новых курсов:
+    только строки, созданные после последней даты курсов на момент обработки
+    Возвращает: список пересчитанных результатов
+    """
+    rates_df = get_currency_rates(rates_file)
+    if rates_df is None or not os.path.isdir(RESULTS_DIR):
+        return []
+
+    now = pd.Timestamp.now()
+    refreshed = []
+    # Пересчёт пишет в ту же статистику и историю, что и обработка загрузки
+    with _PIPELINE_LOCK:
+        for name in sorted(os.listdir(RESULTS_DIR)):
+            if not name.endswith('.checkpoint.json'):
+                continue
+            try:
+                result = _refresh_result(os.path.join(RESULTS_DIR, name), rates_df, now)
+            except Exception as e:
+                print(f"⚠️ Не удалось пересчитать {name}: {e}")
+                continue
+            if result:
+                print(f"🔁 {result['result']}: пересчитано строк {result['rows']} ({result['seconds']} сек)")
+                refreshed.append(result)
+    return refreshed
+
+
 def convert_stats_to_json_serializable(stats):
     """Конвертирует numpy типы в обычные Python типы для JSON"""
     import numpy as np
@@ -547,17 +1287,41 @@ def convert_stats_to_json_serializable(stats):
     return result
 
 
-def process_and_upload(file_path, credentials_file='/home/vulcan4ik/dashboard-cruise-app/credentials.json'):
+def process_and_upload(sources, credentials_file=CREDENTIALS_FILE, progress_id=None):
     """
     Полный пайплайн обработки и загрузки данных
+    sources: источник или список источников (объединяются в один результат)
+    progress_id: идентификатор прогресса для страницы загрузки (см. progress.py)
     Возвращает: (df, filename, stats)
     """
+    global _PROGRESS
+
+    reporter = progress.ProgressReporter(progress_id)
+    reporter.stage('queued')
+
+    # PROCESSING_STATS общая на процесс: параллельные загрузки в потоках воркера идут по очереди
+    with _PIPELINE_LOCK:
+        _PROGRESS = reporter
+        try:
+            result = _run_pipeline(sources, credentials_file)
+        except Exception as e:
+            reporter.fail(str(e))
+            raise
+        finally:
+            _PROGRESS = progress.ProgressReporter()
+
+    reporter.finish(result=result[1])
+    return result
+
+
+def _run_pipeline(sources, credentials_file):
+    """Обработка, сохранение и история; вызывается из process_and_upload под _PIPELINE_LOCK"""
     print("\n" + "="*50)
     print("🚀 НАЧАЛО ОБРАБОТКИ ДАННЫХ")
     print("="*50 + "\n")
 
     # Обработка данных
-    processed_df = process_data(file_path)
+    processed_df = process_data(sources)
 
     print("\n" + "="*50)
     print("📤 СОХРАНЕНИЕ РЕЗУЛЬТАТОВ")
@@ -566,6 +1330,32 @@ def process_and_upload(file_path, credentials_file='/home/vulcan4ik/dashboard-cr
     # Сохраняем локально и пробуем загрузить в Google Sheets
     csv_filename = upload_to_sheets(processed_df, credentials_file)
 
+    # Контрольная точка для пересчёта при появлении новых курсов
+    try:
+        save_checkpoint(processed_df, csv_filename)
+    except Exception as e:
+        print(f"⚠️ Не удалось сохранить контрольную точку: {e}")
+
+    # История путевок: ошибка базы не должна ломать обработку загруженного файла
+    _PROGRESS.stage('history')
+    # Все записи в историю идут через одну очередь в порядке загрузок
+    writer_busy = history_store.pending_writes() > 0
+    history = history_store.submit_results(processed_df, os.path.basename(csv_filename))
+    if len(processed_df) >= history_store.BACKGROUND_MIN_ROWS or writer_busy:
+        # Большая загрузка (или очередь ещё пишет предыдущую) - ответ не ждёт базу
+        PROCESSING_STATS['history_status'] = 'background'
+        print(f"🗄️ История путевок обновляется в фоне ({len(processed_df)} строк)")
+    else:
+        try:
+            history = history.result()
+            PROCESSING_STATS['history_inserted'] = history['inserted']
+            PROCESSING_STATS['history_updated'] = history['updated']
+            PROCESSING_STATS['history_time_sec'] = history['seconds']
+            PROCESSING_STATS['history_status'] = 'done'
+        except Exception as e:
+            PROCESSING_STATS['history_status'] = 'failed'
+            print(f"⚠️ Не удалось обновить историю путевок: {e}")
+
     print("\n" + "="*50)
     print("✅ ОБРАБОТКА ЗАВЕРШЕНА")
     print("="*50 + "\n")
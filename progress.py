@@ -0,0 +1,165 @@
+# progress.py
+"""
+Прогресс обработки загрузки для страницы загрузки (Server-Sent Events)
+
+Обработка идёт в одном воркере gunicorn, а /progress/<id> может попасть в другой,
+поэтому состояние пишется в файл в общей папке PROGRESS_DIR.
+Запись ограничена по частоте: в циклах по строкам счётчик увеличивается на каждой
+строке, время проверяется раз в CHECK_EVERY_ROWS строк, а файл переписывается
+не чаще MIN_WRITE_INTERVAL_SEC.
+"""
+import json
+import os
+import re
+import tempfile
+import time
+
+
+PROGRESS_DIR = os.environ.get('PROGRESS_DIR', os.path.join(tempfile.gettempdir(), 'cruise-dashboard-progress'))
+
+MIN_WRITE_INTERVAL_SEC = 0.25
+CHECK_EVERY_ROWS = 1000
+
+# Файлы завершённых обработок удаляются при следующих загрузках
+PROGRESS_TTL_SEC = 3600
+
+# Идентификатор создаёт страница загрузки: 32 шестнадцатеричных символа
+PROGRESS_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# Этапы по порядку: этап -> (подпись, доля общего прогресса в процентах)
+STAGES = {
+    'queued': ('Ожидание в очереди', 0),
+    'preflight': ('Проверка заголовков', 2),
+    'parse': ('Чтение файлов', 23),
+    'clean': ('Очистка данных', 8),
+    'convert': ('Конвертация валют', 35),
+    'regions': ('Определение регионов', 12),
+    'save': ('Сохранение результата', 5),
+    'sheets': ('Загрузка в Google Sheets', 10),
+    'history': ('История путевок', 5)
+}
+
+# Процент, с которого начинается каждый этап
+_STAGE_START = {}
+_total = 0
+for _stage, (_, _weight) in STAGES.items():
+    _STAGE_START[_stage] = _total
+    _total += _weight
+
+
+def is_valid_id(progress_id):
+    return bool(progress_id) and PROGRESS_ID_RE.match(progress_id) is not None
+
+
+def progress_path(progress_id):
+    return os.path.join(PROGRESS_DIR, f'{progress_id}.json')
+
+
+def read_progress(progress_id):
+    """Последнее записанное состояние или None, если обработка ещё не начиналась"""
+    try:
+        with open(progress_path(progress_id), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _remove_expired():
+    now = time.time()
+    for name in os.listdir(PROGRESS_DIR):
+        path = os.path.join(PROGRESS_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > PROGRESS_TTL_SEC:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+class ProgressReporter:
+    """
+    Прогресс одной обработки. Без progress_id ничего не пишет,
+    поэтому пайплайн вызывает его одинаково и из веб-приложения, и из скриптов
+    """
+
+    def __init__(self, progress_id=None):
+        self.progress_id = progress_id if is_valid_id(progress_id) else None
+        self.state = None
+        self.done = 0
+        self.total = None
+        self._next_check = CHECK_EVERY_ROWS
+        self._last_write = 0.0
+
+        if self.progress_id:
+            os.makedirs(PROGRESS_DIR, exist_ok=True)
+            _remove_expired()
+
+    def stage(self, stage, total=None):
+        """Начало этапа; total - число строк, если этап считает строки"""
+        self.done = 0
+        self.total = total
+        self._next_check = CHECK_EVERY_ROWS
+        self.state = stage
+        self._write('running')
+
+    def advance(self, rows=1):
+        """Обработано ещё rows строк; вызывается в цикле на каждой строке"""
+        self.done += rows
+        if self.done >= self._next_check:
+            self._next_check = self.done + CHECK_EVERY_ROWS
+            if time.monotonic() - self._last_write >= MIN_WRITE_INTERVAL_SEC:
+                self._write('running')
+
+    def counted(self, func):
+        """Обёртка для Series.apply / DataFrame.apply: считает строки на каждом вызове"""
+        if not self.progress_id:
+            return func
+
+        def wrapper(*args, **kwargs):
+            self.advance()
+            return func(*args, **kwargs)
+        return wrapper
+
+    def finish(self, result=None):
+        self.state = None
+        self._write('done', result=result)
+
+    def fail(self, message):
+        self._write('error', message=message)
+
+    def _percent(self):
+        if self.state is None:
+            return 100
+        start = _STAGE_START[self.state]
+        weight = STAGES[self.state][1]
+        if self.total:
+            start += weight * min(self.done, self.total) / self.total
+        return round(start, 1)
+
+    def _write(self, status, **extra):
+        if not self.progress_id:
+            return
+
+        label = STAGES[self.state][0] if self.state else 'Готово'
+        data = {
+            'id': self.progress_id,
+            'status': status,
+            'stage': self.state,
+            'label': label,
+            'done': self.done,
+            'total': self.total,
+            'percent': self._percent(),
+            'updated_at': time.time()
+        }
+        data.update(extra)
+
+        # Подмена файла целиком: /progress никогда не прочитает половину записи
+        path = progress_path(self.progress_id)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # Прогресс - только подсказка пользователю, обработку он не останавливает
+            print(f"⚠️ Не удалось записать прогресс: {e}")
+        self._last_write = time.monotonic()
@@ -0,0 +1,185 @@
+# results_cache.py
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+# Сколько результатов держим в памяти одновременно
+CACHE_MAX_ENTRIES = int(os.environ.get('RESULTS_CACHE_SIZE', 4))
+
+# Столбцы, по которым разрешена фильтрация и сортировка
+FILTER_COLUMNS = ['creation_month', 'region', 'manager', 'voucher_status', 'currency']
+SORT_COLUMNS = ['amount_rub', 'checkin_date']
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# LRU-кэш: путь к CSV -> колоночное представление результата
+_RESULTS_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def _load_entry(csv_path, mtime):
+    """Читает CSV результата и готовит колоночные структуры для запросов"""
+    df = pd.read_csv(
+        csv_path,
+        encoding='utf-8-sig',
+        dtype={column: 'category' for column in FILTER_COLUMNS}
+    )
+
+    # Для фильтров держим только целочисленные коды категорий
+    codes = {}
+    for column in FILTER_COLUMNS:
+        if column in df.columns:
+            codes[column] = (df[column].cat.categories, df[column].cat.codes.to_numpy())
+
+    print(f"🗂️ Результат загружен в кэш: {os.path.basename(csv_path)} ({len(df)} строк)")
+
+    return {
+        'mtime': mtime,
+        'df': df,
+        'codes': codes,
+        'orders': {}
+    }
+
+
+def get_result(csv_path):
+    """Возвращает закэшированный результат, перечитывая его при изменении файла"""
+    mtime = os.path.getmtime(csv_path)
+
+    with _CACHE_LOCK:
+        entry = _RESULTS_CACHE.get(csv_path)
+        if entry is not None and entry['mtime'] == mtime:
+            _RESULTS_CACHE.move_to_end(csv_path)
+            return entry
+
+    entry = _load_entry(csv_path, mtime)
+
+    with _CACHE_LOCK:
+        _RESULTS_CACHE[csv_path] = entry
+        _RESULTS_CACHE.move_to_end(csv_path)
+        while len(_RESULTS_CACHE) > CACHE_MAX_ENTRIES:
+            evicted_path, _ = _RESULTS_CACHE.popitem(last=False)
+            print(f"🗑️ Результат вытеснен из кэша: {os.path.basename(evicted_path)}")
+
+    return entry
+
+
+def _sort_order(entry, column, descending):
+    """Порядок строк для сортировки (считается один раз на результат)"""
+    key = (column, descending)
+    order = entry['orders'].get(key)
+    if order is not None:
+        return order
+
+    series = entry['df'][column]
+    if column == 'checkin_date':
+        values = pd.to_datetime(series, errors='coerce')
+    else:
+        values = pd.to_numeric(series, errors='coerce')
+
+    # Пустые значения всегда в конце, при равенстве сохраняем исходный порядок
+    order = values.sort_values(
+        ascending=not descending, kind='stable', na_position='last'
+    ).index.to_numpy()
+
+    entry['orders'][key] = order
+    return order
+
+
+def _filter_mask(entry, filters):
+    """Строит булеву маску по фильтрам {столбец: [значения]}"""
+    mask = None
+    for column, values in filters.items():
+        if column not in entry['codes']:
+            raise ValueError(f'Фильтр по столбцу {column} недоступен')
+
+        categories, column_codes = entry['codes'][column]
+        wanted = categories.get_indexer(values)
+        wanted = np.unique(wanted[wanted >= 0])
+
+        if len(wanted) <= 8:
+            # Несколько сравнений кодов быстрее выборки по таблице
+            column_mask = np.zeros(len(column_codes), dtype=bool)
+            for code in wanted:
+                column_mask |= column_codes == code
+        else:
+            # Таблица "код -> подходит"; последний элемент для пустых (код -1)
+            lookup = np.zeros(len(categories) + 1, dtype=bool)
+            lookup[wanted] = True
+            column_mask = lookup[column_codes]
+
+        mask = column_mask if mask is None else (mask & column_mask)
+    return mask
+
+
+def query_result(csv_path, page=1, per_page=DEFAULT_PAGE_SIZE, columns=None,
+                 filters=None, sort=None):
+    """
+    Постраничная выборка из результата
+    sort: имя столбца, '-' в начале - по убыванию
+    Возвращает: (total, DataFrame страницы)
+    """
+    entry = get_result(csv_path)
+    df = entry['df']
+
+    if columns:
+        unknown = [column for column in columns if column not in df.columns]
+        if unknown:
+            raise ValueError(f'Неизвестные столбцы: {", ".join(unknown)}')
+    else:
+        columns = list(df.columns)
+
+    if page < 1 or not 1 <= per_page <= MAX_PAGE_SIZE:
+        raise ValueError(f'page >= 1, per_page от 1 до {MAX_PAGE_SIZE}')
+
+    mask = _filter_mask(entry, filters) if filters else None
+
+    order = None
+    if sort:
+        descending = sort.startswith('-')
+        sort_column = sort.lstrip('-')
+        if sort_column not in SORT_COLUMNS or sort_column not in df.columns:
+            raise ValueError(f'Сортировка возможна только по: {", ".join(SORT_COLUMNS)}')
+        order = _sort_order(entry, sort_column, descending)
+
+    start = (page - 1) * per_page
+    end = start + per_page
+
+    # Отбираем номера строк, не трогая сам DataFrame
+    if order is not None and mask is not None:
+        total = int(mask.sum())
+        selected = _first_matching(order, mask, end)
+    elif order is not None:
+        total = len(order)
+        selected = order
+    elif mask is not None:
+        total = int(mask.sum())
+        selected = np.flatnonzero(mask)
+    else:
+        total = len(df)
+        selected = None
+
+    if selected is None:
+        page_df = df.iloc[start:end]
+    else:
+        page_df = df.iloc[selected[start:end]]
+
+    return total, page_df[columns]
+
+
+def _first_matching(order, mask, limit, block_size=65536):
+    """Первые limit строк в порядке сортировки, прошедших фильтр"""
+    found = []
+    found_count = 0
+    for block_start in range(0, len(order), block_size):
+        block = order[block_start:block_start + block_size]
+        block = block[mask[block]]
+        found.append(block)
+        found_count += len(block)
+        if found_count >= limit:
+            break
+    return np.concatenate(found) if found else order[:0]
@@ -0,0 +1,128 @@
+# tools/bench_first_upload.py
+"""
+Время первой загрузки файла на свежем воркере gunicorn - с прогревом и без
+
+Для каждого режима запускается отдельный gunicorn (gunicorn.conf.py, один воркер),
+после ответа /ready на /upload отправляется sample_data/sample_input.xlsx.
+Первая загрузка сравнивается со второй - разница и есть стоимость холодного воркера.
+
+Запуск из корня проекта:
+    python tools/bench_first_upload.py
+    python tools/bench_first_upload.py --runs 5 --file sample_data/sample_input.xlsx
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILE = os.path.join(PROJECT_DIR, 'sample_data', 'sample_input.xlsx')
+
+READY_TIMEOUT_SEC = 120
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Ответ /upload - редирект на /success; замеряем сам POST, без перехода"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(base_url, process):
+    """Ждёт 200 от /ready, возвращает время старта в секундах"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < READY_TIMEOUT_SEC:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn завершился при старте')
+        try:
+            with urllib.request.urlopen(f'{base_url}/ready', timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - started
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            pass
+        time.sleep(0.05)
+    raise RuntimeError('gunicorn не ответил на /ready')
+
+
+def post_upload(base_url, file_path):
+    """POST /upload одного файла, возвращает время ответа в секундах"""
+    boundary = uuid.uuid4().hex
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="file"; filename="{os.path.basename(file_path)}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+
+    request = urllib.request.Request(
+        f'{base_url}/upload',
+        data=body,
+        headers={'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    )
+    opener = urllib.request.build_opener(NoRedirect)
+
+    started = time.perf_counter()
+    try:
+        opener.open(request, timeout=600).read()
+    except urllib.error.HTTPError as e:
+        # 302 на /success - успешная обработка
+        if e.code != 302:
+            raise
+    return time.perf_counter() - started
+
+
+def run_once(file_path, warmup_enabled):
+    """Свежий gunicorn: (старт до /ready, первая загрузка, вторая загрузка)"""
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, WARMUP='1' if warmup_enabled else '0',
+               GUNICORN_BIND=f'127.0.0.1:{port}', GUNICORN_WORKERS='1')
+
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+        cwd=PROJECT_DIR, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        startup = wait_ready(base_url, process)
+        first = post_upload(base_url, file_path)
+        second = post_upload(base_url, file_path)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return startup, first, second
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Первая загрузка на свежем воркере: с прогревом и без')
+    parser.add_argument('--file', default=SAMPLE_FILE)
+    parser.add_argument('--runs', type=int, default=3, help='берётся медиана из N запусков')
+    args = parser.parse_args()
+
+    print(f"🧪 Файл: {args.file}, запусков на режим: {args.runs}")
+    for warmup_enabled in (False, True):
+        runs = [run_once(args.file, warmup_enabled) for _ in range(args.runs)]
+        startup, first, second = (statistics.median(values) for values in zip(*runs))
+        label = 'с прогревом' if warmup_enabled else 'без прогрева'
+        print(f"⏱️ {label:>13}: старт до /ready {startup:.2f} сек, "
+              f"первая загрузка {first:.2f} сек, вторая {second:.2f} сек "
+              f"(стоимость холодного воркера {first - second:+.2f} сек)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+# tools/bench_pipeline.py
+"""
+Замер пайплайна process_data на синтетическом наборе данных
+
+Набор строится из sample_data/sample_input.xlsx: строки размножаются до --rows,
+получают уникальные номера путевок (часть повторяется), разные валюты, статусы и даты.
+
+Запуск из корня проекта:
+    python tools/bench_pipeline.py --rows 100000
+    python tools/bench_pipeline.py --rows 100000 --output /tmp/result.csv
+
+Печатает время обработки и пиковый RSS на строку входного файла
+(пик берётся из /proc/self/status, поэтому замер памяти работает только в Linux).
+С --output сохраняет результат, чтобы сравнить его между версиями.
+"""
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILE = os.path.join(PROJECT_DIR, 'sample_data', 'sample_input.xlsx')
+
+
+def build_dataset(rows, path, seed=42):
+    """Генерирует CSV с rows строками в формате выгрузки"""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    sample = pd.read_excel(SAMPLE_FILE)
+    df = sample.iloc[rng.integers(0, len(sample), rows)].reset_index(drop=True)
+
+    # ~2% путевок повторяются - как при пересечении выгрузок филиалов
+    voucher_numbers = np.arange(rows)
+    repeated = rng.random(rows) < 0.02
+    voucher_numbers[repeated] = rng.integers(0, rows, repeated.sum())
+    df['Путевка'] = [f'BENCH{n:08d}' for n in voucher_numbers]
+
+    df['Валюта'] = rng.choice(['E', '$', 'рб', 'Е', 'EUR'], rows)
+    df['Статус путевки'] = rng.choice(
+        ['ОК Оплата внесена', 'ОК Предоплата внесен', 'Аннулирован', 'Удален'],
+        rows, p=[0.6, 0.25, 0.1, 0.05]
+    )
+
+    creation = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 700 * 86400, rows), unit='s')
+    df['Дата создания'] = creation.strftime('%Y-%m-%d %H:%M:%S')
+    df['Дата заезда'] = (creation + pd.to_timedelta(rng.integers(1, 400, rows), unit='D')).strftime('%Y-%m-%d')
+
+    df.to_csv(path, index=False)
+
+
+def read_memory_kb(field):
+    """Поле из /proc/self/status в килобайтах (VmRSS - текущий, VmHWM - пиковый RSS)"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def reset_peak_rss():
+    """Сбрасывает VmHWM до текущего RSS, чтобы пик относился только к пайплайну"""
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+
+
+def run_pipeline(input_path, output_path):
+    """Выполняется в отдельном процессе, чтобы пиковый RSS относился только к пайплайну"""
+    sys.path.insert(0, PROJECT_DIR)
+    import processsing
+
+    # Курсы загружаем заранее - они не относятся к памяти на строку
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        processsing.get_currency_rates()
+
+    rss_before = read_memory_kb('VmRSS')
+    reset_peak_rss()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        df = processsing.process_data(input_path)
+    elapsed = time.perf_counter() - started
+    rss_peak = read_memory_kb('VmHWM')
+
+    if output_path:
+        df.to_csv(output_path, index=False)
+
+    print(json.dumps({
+        'input_rows': processsing.PROCESSING_STATS['original_rows'],
+        'output_rows': len(df),
+        'seconds': round(elapsed, 2),
+        'rss_before_mb': round(rss_before / 1024, 1),
+        'rss_peak_mb': round(rss_peak / 1024, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Время и пиковая память пайплайна обработки')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--output', help='куда сохранить результат для сравнения версий')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_pipeline(args.run, args.output)
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, f'bench_{args.rows}.csv')
+        print(f"🧪 Генерация набора: {args.rows} строк...")
+        build_dataset(args.rows, input_path)
+
+        command = [sys.executable, os.path.abspath(__file__), '--run', input_path]
+        if args.output:
+            command += ['--output', args.output]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(result.stderr)
+            return 1
+
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    pipeline_mb = stats['rss_peak_mb'] - stats['rss_before_mb']
+    bytes_per_row = pipeline_mb * 1024 * 1024 / stats['input_rows']
+
+    print(f"📊 Строк: {stats['input_rows']} -> {stats['output_rows']}")
+    print(f"⏱️ Время: {stats['seconds']} сек")
+    print(f"💾 Пиковый RSS: {stats['rss_peak_mb']} МБ (прирост за пайплайн {pipeline_mb:.1f} МБ)")
+    print(f"💾 На строку входа: {bytes_per_row:.0f} байт")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
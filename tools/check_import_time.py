@@ -0,0 +1,85 @@
+# tools/check_import_time.py
+"""
+Проверка времени холодного импорта приложения через python -X importtime
+
+Запуск из корня проекта:
+    python tools/check_import_time.py
+    python tools/check_import_time.py --budget-ms 500 --runs 5
+
+Возвращает код 1, если импорт app дольше бюджета или при импорте
+подтянулись модули, которые должны загружаться только по требованию.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Бюджет на холодный импорт app, мс (можно переопределить через IMPORT_BUDGET_MS)
+DEFAULT_BUDGET_MS = int(os.environ.get('IMPORT_BUDGET_MS', 800))
+
+# Эти интеграции нужны не на каждый запрос и должны импортироваться лениво
+LAZY_MODULES = ['gspread', 'google.oauth2', 'google.auth', 'openpyxl']
+
+
+def measure_import(module):
+    """Один холодный импорт в отдельном процессе: (время модуля в мкс, {модуль: мкс})"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'Импорт {module} завершился с ошибкой:\n{result.stderr}')
+
+    # Формат строк: "import time:   self [us] | cumulative | imported package"
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        timings[name.strip()] = int(cumulative)
+
+    return timings[module], timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бюджет времени холодного импорта приложения')
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--budget-ms', type=int, default=DEFAULT_BUDGET_MS)
+    parser.add_argument('--runs', type=int, default=3, help='берётся лучший из N запусков')
+    parser.add_argument('--top', type=int, default=10, help='сколько самых тяжёлых модулей показать')
+    args = parser.parse_args()
+
+    runs = [measure_import(args.module) for _ in range(args.runs)]
+    best_us, timings = min(runs, key=lambda run: run[0])
+    best_ms = best_us / 1000
+
+    print(f"⏱️ Импорт {args.module}: {best_ms:.0f} мс (лучший из {args.runs}), бюджет {args.budget_ms} мс")
+    print("📋 Самые тяжёлые модули верхнего уровня:")
+    top_level = {name: us for name, us in timings.items() if '.' not in name and name != args.module}
+    for name, us in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"   {us / 1000:8.1f} мс  {name}")
+
+    failed = False
+
+    eager = [name for name in LAZY_MODULES
+             if any(imported == name or imported.startswith(name + '.') for imported in timings)]
+    if eager:
+        print(f"❌ При импорте {args.module} загружены модули, которые должны быть ленивыми: {', '.join(eager)}")
+        failed = True
+
+    if best_ms > args.budget_ms:
+        print(f"❌ Импорт {args.module} превышает бюджет: {best_ms:.0f} > {args.budget_ms} мс")
+        failed = True
+
+    if not failed:
+        print("✅ Бюджет времени импорта соблюдён")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
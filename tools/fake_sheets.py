@@ -0,0 +1,51 @@
+# tools/fake_sheets.py
+"""
+Клиент Google Sheets без сети для нагрузочного теста
+
+Подключается через CRUISE_SHEETS_CLIENT=tools.fake_sheets:make_client.
+Повторяет ту часть API gspread, которой пользуется processsing.upload_to_sheets,
+и имитирует задержку сети (FAKE_SHEETS_LATENCY_MS, по умолчанию 300 мс на загрузку).
+"""
+import os
+import time
+
+
+LATENCY_SEC = int(os.environ.get('FAKE_SHEETS_LATENCY_MS', 300)) / 1000
+
+
+class FakeWorksheet:
+    def __init__(self):
+        self.rows = 0
+
+    def clear(self):
+        self.rows = 0
+
+    def update(self, range_name, values):
+        # Как и настоящий API, получает все значения целиком
+        time.sleep(LATENCY_SEC)
+        self.rows = len(values)
+
+
+class FakeSpreadsheet:
+    url = 'https://docs.google.com/spreadsheets/d/fake'
+
+    def __init__(self):
+        self.worksheet = FakeWorksheet()
+
+    def get_worksheet(self, index):
+        return self.worksheet
+
+    def share(self, value, perm_type, role):
+        pass
+
+
+class FakeClient:
+    def open(self, name):
+        return FakeSpreadsheet()
+
+    def create(self, name):
+        return FakeSpreadsheet()
+
+
+def make_client():
+    return FakeClient()
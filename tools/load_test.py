@@ -0,0 +1,371 @@
+# tools/load_test.py
+"""
+Нагрузочный тест веб-приложения: загрузка, страница результата и скачивание
+
+Запускает app под gunicorn (gunicorn.conf.py) в изолированном окружении:
+заглушка курсов валют, отдельные папки результатов и базы истории,
+клиент Google Sheets без сети (tools/fake_sheets.py). Затем на нескольких
+уровнях параллельности проигрывает смесь запросов /, /upload, /success, /download.
+
+Запуск из корня проекта:
+    python tools/load_test.py
+    python tools/load_test.py --concurrency 1,4,16 --duration 20 --sizes 1000,20000
+    python tools/load_test.py --mix index=2,upload=1,success=2,download=4 --output before.json
+    python tools/load_test.py --output after.json --compare before.json
+
+Для каждого уровня печатает пропускную способность, p50/p95/p99 задержки,
+долю ошибок и пиковый RSS воркеров (из /proc, поэтому RSS - только в Linux).
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_first_upload import NoRedirect, free_port, wait_ready  # noqa: E402
+from bench_pipeline import build_dataset  # noqa: E402
+
+
+DEFAULT_MIX = 'index=3,upload=1,success=2,download=3'
+REQUEST_TIMEOUT_SEC = 600
+RSS_SAMPLE_SEC = 0.5
+
+
+def parse_mix(text):
+    """'index=3,upload=1' -> {'index': 3, 'upload': 1}"""
+    mix = {}
+    for part in text.split(','):
+        name, weight = part.split('=')
+        if name not in ('index', 'upload', 'success', 'download'):
+            raise ValueError(f'Неизвестный тип запроса: {name}')
+        mix[name] = float(weight)
+    return mix
+
+
+def write_stub_rates(path):
+    """Курсы USD/EUR на каждый день с 2023 года по сегодня - без обращения к ЦБ"""
+    import pandas as pd
+    dates = pd.date_range('2023-01-01', pd.Timestamp.now().normalize(), freq='D')
+    pd.DataFrame({
+        'date': dates.strftime('%Y-%m-%d'),
+        'USD': 90.0,
+        'EUR': 100.0
+    }).to_csv(path, index=False)
+
+
+def proc_rss_kb(pid):
+    """Текущий RSS процесса, 0 если процесс уже завершился"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def worker_pids(master_pid):
+    """Дочерние процессы мастера gunicorn"""
+    try:
+        with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+            return [int(pid) for pid in f.read().split()]
+    except OSError:
+        return []
+
+
+class RssSampler(threading.Thread):
+    """Периодически снимает RSS воркеров, запоминает пики"""
+
+    def __init__(self, master_pid):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.stop_event = threading.Event()
+        self.peak_worker_kb = 0
+        self.peak_total_kb = 0
+
+    def run(self):
+        while not self.stop_event.is_set():
+            rss = [proc_rss_kb(pid) for pid in worker_pids(self.master_pid)]
+            if rss:
+                self.peak_worker_kb = max(self.peak_worker_kb, max(rss))
+                self.peak_total_kb = max(self.peak_total_kb, sum(rss))
+            self.stop_event.wait(RSS_SAMPLE_SEC)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+class Client:
+    """Запросы к приложению; cookie сессии берётся из загрузки (нужна для /success)"""
+
+    def __init__(self, base_url, upload_files):
+        self.base_url = base_url
+        self.upload_files = upload_files
+        self.opener = urllib.request.build_opener(NoRedirect)
+        self.results = []
+        self.session_cookie = None
+        self.lock = threading.Lock()
+
+    def _request(self, path, data=None, headers=None):
+        """(status, заголовки) - редиректы не выполняются"""
+        request = urllib.request.Request(self.base_url + path, data=data, headers=headers or {})
+        try:
+            with self.opener.open(request, timeout=REQUEST_TIMEOUT_SEC) as response:
+                response.read()
+                return response.status, response.headers
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, e.headers
+
+    def upload(self, rng):
+        path = rng.choice(self.upload_files)
+        boundary = uuid.uuid4().hex
+        with open(path, 'rb') as f:
+            content = f.read()
+        body = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="file"; filename="{os.path.basename(path)}"\r\n'
+            f'Content-Type: text/csv\r\n\r\n'
+        ).encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+
+        status, headers = self._request('/upload', body, {
+            'Content-Type': f'multipart/form-data; boundary={boundary}'
+        })
+        location = headers.get('Location', '')
+        # Успех - редирект на /success?filename=..., ошибка - редирект на главную
+        ok = status == 302 and '/success' in location
+        if ok:
+            filename = urllib.parse.parse_qs(urllib.parse.urlparse(location).query)['filename'][0]
+            cookie = headers.get('Set-Cookie', '').split(';')[0]
+            with self.lock:
+                self.results.append(filename)
+                self.session_cookie = cookie or self.session_cookie
+        return ok, os.path.basename(path)
+
+    def index(self, rng):
+        status, _ = self._request('/')
+        return status == 200, None
+
+    def success(self, rng):
+        filename = rng.choice(self.results)
+        status, _ = self._request(f'/success?filename={filename}', headers={'Cookie': self.session_cookie})
+        return status == 200, None
+
+    def download(self, rng):
+        filename = rng.choice(self.results)
+        status, _ = self._request(f'/download/{filename}')
+        return status == 200, None
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def latency_summary(samples):
+    latencies = sorted(sample['ms'] for sample in samples)
+    errors = sum(1 for sample in samples if not sample['ok'])
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': round(errors / len(samples), 4) if samples else 0,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+    }
+
+
+def run_level(client, mix, concurrency, duration, seed):
+    """Прогоняет concurrency параллельных клиентов в течение duration секунд"""
+    samples = []
+    samples_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+
+    def user(user_id):
+        rng = random.Random(seed * 1000 + user_id)
+        while time.perf_counter() < deadline:
+            kind = rng.choices(kinds, weights)[0]
+            started = time.perf_counter()
+            try:
+                ok, detail = getattr(client, kind)(rng)
+            except Exception as e:
+                ok, detail = False, str(e)
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            with samples_lock:
+                samples.append({'kind': kind, 'ok': ok, 'ms': elapsed_ms, 'detail': detail})
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    result = {'concurrency': concurrency, 'seconds': round(wall, 2)}
+    result.update(latency_summary(samples))
+    result['throughput_rps'] = round(len(samples) / wall, 2)
+    result['by_kind'] = {
+        kind: latency_summary([s for s in samples if s['kind'] == kind])
+        for kind in kinds if any(s['kind'] == kind for s in samples)
+    }
+    uploads = [s for s in samples if s['kind'] == 'upload' and s['ok']]
+    result['uploads_by_file'] = {
+        name: latency_summary([s for s in uploads if s['detail'] == name])
+        for name in sorted({s['detail'] for s in uploads})
+    }
+    return result
+
+
+def print_level(level):
+    print(f"📊 Параллельность {level['concurrency']:>3}: {level['throughput_rps']:>7.2f} req/s, "
+          f"p50 {level['p50_ms']} мс, p95 {level['p95_ms']} мс, p99 {level['p99_ms']} мс, "
+          f"ошибок {level['error_rate'] * 100:.1f}%, "
+          f"RSS воркера до {level['peak_worker_rss_mb']} МБ (всего {level['peak_total_rss_mb']} МБ)")
+    for kind, summary in level['by_kind'].items():
+        print(f"      {kind:<9} {summary['requests']:>5} запросов, p50 {summary['p50_ms']} мс, "
+              f"p95 {summary['p95_ms']} мс, ошибок {summary['errors']}")
+
+
+def print_comparison(current, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {level['concurrency']: level for level in baseline['levels']}
+
+    print(f"\n🔁 Сравнение с {baseline_path} ({baseline.get('commit') or 'без коммита'}):")
+    for level in current['levels']:
+        before = previous.get(level['concurrency'])
+        if not before:
+            continue
+        print(f"   {level['concurrency']:>3}: req/s {before['throughput_rps']} -> {level['throughput_rps']}, "
+              f"p95 {before['p95_ms']} -> {level['p95_ms']} мс, "
+              f"ошибок {before['error_rate'] * 100:.1f}% -> {level['error_rate'] * 100:.1f}%")
+
+
+def git_commit():
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR,
+                            capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест загрузки и скачивания под gunicorn')
+    parser.add_argument('--concurrency', default='1,2,4,8', help='уровни параллельности через запятую')
+    parser.add_argument('--duration', type=float, default=15, help='секунд на уровень')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='веса запросов index/upload/success/download')
+    parser.add_argument('--sizes', default='1000,10000,50000', help='размеры загружаемых файлов в строках')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--sheets-latency-ms', type=int, default=300, help='имитация задержки Google Sheets')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='куда сохранить результаты (JSON)')
+    parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    levels = [int(level) for level in args.concurrency.split(',')]
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    with tempfile.TemporaryDirectory(prefix='cruise_load_') as tmp_dir:
+        rates_file = os.path.join(tmp_dir, 'rates.csv')
+        write_stub_rates(rates_file)
+
+        print(f"🧪 Генерация файлов загрузки: {', '.join(map(str, sizes))} строк...")
+        upload_files = []
+        for size in sizes:
+            path = os.path.join(tmp_dir, f'load_{size}.csv')
+            build_dataset(size, path, seed=args.seed)
+            upload_files.append(path)
+
+        port = free_port()
+        base_url = f'http://127.0.0.1:{port}'
+        env = dict(
+            os.environ,
+            CURRENCY_RATES_FILE=rates_file,
+            RESULTS_DIR=os.path.join(tmp_dir, 'results'),
+            HISTORY_DB=os.path.join(tmp_dir, 'history', 'history.sqlite3'),
+            PROMETHEUS_MULTIPROC_DIR=os.path.join(tmp_dir, 'metrics'),
+            CRUISE_SHEETS_CLIENT='tools.fake_sheets:make_client',
+            FAKE_SHEETS_LATENCY_MS=str(args.sheets_latency_ms),
+            GUNICORN_BIND=f'127.0.0.1:{port}',
+            GUNICORN_WORKERS=str(args.workers),
+            GUNICORN_THREADS=str(args.threads),
+        )
+        log_path = os.path.join(tmp_dir, 'gunicorn.log')
+        with open(log_path, 'w') as log:
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                cwd=PROJECT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+            )
+
+        try:
+            print(f"🚀 gunicorn: {args.workers} воркера x {args.threads} потока, {base_url}")
+            wait_ready(base_url, server)
+            idle_rss = [proc_rss_kb(pid) for pid in worker_pids(server.pid)]
+
+            # Первая загрузка даёт результат для /success и /download
+            client = Client(base_url, upload_files)
+            ok, _ = client.upload(random.Random(args.seed))
+            if not ok:
+                raise RuntimeError(f'Первая загрузка не удалась, см. лог gunicorn: {log_path}')
+
+            results = []
+            for concurrency in levels:
+                sampler = RssSampler(server.pid)
+                sampler.start()
+                level = run_level(client, mix, concurrency, args.duration, args.seed + concurrency)
+                sampler.stop()
+                level['peak_worker_rss_mb'] = round(sampler.peak_worker_kb / 1024, 1)
+                level['peak_total_rss_mb'] = round(sampler.peak_total_kb / 1024, 1)
+                results.append(level)
+                print_level(level)
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+
+    report = {
+        'commit': git_commit(),
+        'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'config': {
+            'workers': args.workers,
+            'threads': args.threads,
+            'duration_sec': args.duration,
+            'mix': mix,
+            'sizes': sizes,
+            'sheets_latency_ms': args.sheets_latency_ms,
+        },
+        'idle_worker_rss_mb': [round(kb / 1024, 1) for kb in idle_rss],
+        'levels': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты сохранены: {args.output}")
+
+    if args.compare:
+        print_comparison(report, args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
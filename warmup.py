@@ -0,0 +1,119 @@
+# warmup.py
+"""
+Прогрев приложения до приёма запросов
+
+В gunicorn с preload_app вызывается в мастере до fork (см. gunicorn.conf.py):
+воркеры получают уже загруженные библиотеки, курсы валют и таблицы регионов
+через copy-on-write и не тратят на это время первой загрузки.
+"""
+import importlib
+import io
+import threading
+import time
+
+
+# Библиотеки, которые иначе импортируются только при первой обработке
+HEAVY_MODULES = ['openpyxl', 'pandas.io.excel._openpyxl', 'sqlite3']
+
+WARMUP_STATE = {
+    'ready': False,
+    'started_at': None,
+    'seconds': None,
+    'skipped': False,
+    'steps': {},
+    'errors': []
+}
+
+_WARMUP_LOCK = threading.Lock()
+
+# Фоновый прогрев запускается один раз на процесс (_WARMUP_LOCK держится весь прогрев)
+_BACKGROUND_LOCK = threading.Lock()
+_BACKGROUND_THREAD = None
+
+
+def _step(name, func):
+    """Выполняет шаг прогрева и запоминает его время; ошибка шага не останавливает прогрев"""
+    started = time.perf_counter()
+    try:
+        func()
+    except Exception as e:
+        WARMUP_STATE['errors'].append(f'{name}: {e}')
+        print(f"⚠️ Прогрев: шаг {name} завершился ошибкой: {e}")
+    WARMUP_STATE['steps'][name] = round(time.perf_counter() - started, 3)
+
+
+def _import_heavy_modules():
+    for module in HEAVY_MODULES:
+        importlib.import_module(module)
+
+
+def _load_currency_rates():
+    import processsing
+    if processsing.get_currency_rates() is None:
+        raise RuntimeError('курсы валют не загружены')
+
+
+def _compile_region_matcher():
+    import processsing
+    # Таблицы строятся при импорте processsing; прогоняем разбор, чтобы
+    # скомпилировались и закэшировались регулярные выражения
+    processsing.extract_region('ООО Ромашка, Москва')
+    processsing.extract_region('ИП Иванов; Калуга')
+
+
+def _open_history_store():
+    # Схема базы истории создаётся один раз, а не на первой загрузке
+    import history_store
+    history_store.connect().close()
+
+
+def _warm_pandas_parsers():
+    # Первый вызов read_csv / to_datetime подгружает внутренние модули pandas
+    import pandas as pd
+    df = pd.read_csv(io.StringIO('a,b\n1,2025-01-01 10:00:00\n'))
+    pd.to_datetime(df['b'], format='%Y-%m-%d %H:%M:%S')
+    pd.to_numeric(df['a'], errors='coerce')
+
+
+def warmup():
+    """Прогревает процесс один раз; повторные вызовы ничего не делают"""
+    with _WARMUP_LOCK:
+        if WARMUP_STATE['ready']:
+            return WARMUP_STATE
+
+        print("🔥 Прогрев приложения...")
+        WARMUP_STATE['started_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        started = time.perf_counter()
+
+        _step('import_modules', _import_heavy_modules)
+        _step('currency_rates', _load_currency_rates)
+        _step('region_matcher', _compile_region_matcher)
+        _step('history_store', _open_history_store)
+        _step('pandas_parsers', _warm_pandas_parsers)
+
+        WARMUP_STATE['seconds'] = round(time.perf_counter() - started, 3)
+        WARMUP_STATE['ready'] = True
+        print(f"✅ Прогрев завершён за {WARMUP_STATE['seconds']} сек: {WARMUP_STATE['steps']}")
+        return WARMUP_STATE
+
+
+def skip_warmup():
+    """Помечает процесс готовым без прогрева (WARMUP=0) - для замеров холодного старта"""
+    with _WARMUP_LOCK:
+        WARMUP_STATE['skipped'] = True
+        WARMUP_STATE['ready'] = True
+
+
+def warmup_in_background():
+    """
+    Прогрев без хука gunicorn.conf.py (python app.py, flask run, WSGI на PythonAnywhere,
+    gunicorn без конфига): не задерживает старт, /ready ответит 200 после завершения.
+    Повторные вызовы и вызов после прогрева ничего не запускают
+    """
+    global _BACKGROUND_THREAD
+    with _BACKGROUND_LOCK:
+        if WARMUP_STATE['ready'] or _BACKGROUND_THREAD is not None:
+            return _BACKGROUND_THREAD
+        _BACKGROUND_THREAD = threading.Thread(target=warmup, name='warmup', daemon=True)
+        _BACKGROUND_THREAD.start()
+        return _BACKGROUND_THREAD